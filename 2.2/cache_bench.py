@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 2
+# Task 2.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Used to benchmark the per-hit and per-write overhead of the memory cache,
+# comparing the proxy with the former dict entries and key hashing.
+# Usage: sudo python3 cache_bench.py
+#
+
+import hashlib
+import sys
+import time
+import timeit
+
+from mem_cache import MemCache
+from cproxyd import AsynCompressProxy
+
+
+class DictEntryCache(MemCache):
+    '''
+    The memory cache with its former entry representation, a dict for each
+    entry, kept here only for comparison.
+    '''
+
+    def get(self, key):
+        entry = self.entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry['expire'] < time.monotonic():
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry['content']
+
+
+    def put(self, key, value, ttl=None, validators=None):
+        size = self._entry_size(key, value)
+
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = dict()
+        self.entries[key]['expire'] = time.monotonic() \
+            + (self.ttl if ttl is None else ttl)
+        self.entries[key]['size'] = size
+        self.entries[key]['content'] = value
+        self.entries[key]['validators'] = validators
+        self.cur_bytes += size
+
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.cur_bytes -= entry['size']
+
+
+def calc_hash(target, encoding):
+    """
+    The cache key, as formerly calculated by the proxy on every call.
+    """
+
+    return '%s-%s' % (hashlib.md5(target.encode()).hexdigest(), encoding)
+
+
+def bench(label, func, number):
+    """
+    Printing the mean time of one call in nanoseconds, best of five runs.
+    """
+
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    print('%-40s %8.1f ns' % (label, best / number * 1e9))
+
+
+if __name__ == '__main__':
+    entries = 10000
+    number = 200000
+    value = (b'HTTP/1.1 200 OK\r\nContent-Length: 1024\r\n', b'x' * 1024)
+    targets = ['http://example.com/page/%d' % i for i in range(entries)]
+
+    proxy = AsynCompressProxy(cache_size=1 << 30)
+    new_hash = proxy._calc_hash
+    new_cache = proxy.mem_cached
+    old_cache = DictEntryCache(max_bytes=1 << 30)
+    for target in targets:
+        old_cache.put(calc_hash(target, 'gzip'), value)
+        new_cache.put(new_hash(target, 'gzip'), value)
+
+    target = targets[entries // 2]
+    key = calc_hash(target, 'gzip')
+
+    print('Per hit:')
+    bench('dict entry',
+          lambda: old_cache.get(calc_hash(target, 'gzip')), number)
+    bench('slotted entry',
+          lambda: new_cache.get(new_hash(target, 'gzip')), number)
+    bench('dict entry, lookup only', lambda: old_cache.get(key), number)
+    bench('slotted entry, lookup only', lambda: new_cache.get(key), number)
+
+    # Formerly the key was hashed again by each step of a miss: memory and
+    # disk lookup, starting the fetch, the fetch, memory and disk write
+    print('Per miss and write:')
+    bench('dict entry, key hashed six times',
+          lambda: [calc_hash(target, 'gzip') for _ in range(5)]
+          and old_cache.put(calc_hash(target, 'gzip'), value), number)
+    bench('slotted entry, key computed once',
+          lambda: new_cache.put(new_hash(target, 'gzip'), value), number)
+
+    print('Per entry:')
+    old_entry = old_cache.entries[key]
+    new_entry = new_cache.entries[key]
+    print('%-40s %8d B' % ('dict entry', sys.getsizeof(old_entry)))
+    print('%-40s %8d B' % ('slotted entry', sys.getsizeof(new_entry)))
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 2
+# Task 2.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Per-host pool of persistent (keep-alive) connections to web servers.
+#
+
+import asyncio
+from collections import deque
+import socket
+
+
+class UpstreamTimeout(Exception):
+    '''
+    A web server didn't accept, or didn't answer in time, or no connection
+    slot of the host became free in time.
+    '''
+
+
+class ConnPool(object):
+    '''
+    Pool of idle keep-alive connections, grouped by (scheme, host, port).
+
+    Args:
+        max_per_host: The maximum number of open connections to one host.
+        idle_timeout: Seconds after which an idle connection is closed.
+        resolver:
+            The DNSCache object resolving host names, or None for resolving
+            on every connection.
+        happy_eyeballs_delay:
+            Seconds before trying the next address of a host while the
+            previous attempt is still pending, or None for trying the
+            addresses one after another.
+        connect_timeout:
+            Seconds for resolving a host and establishing a connection.
+        acquire_timeout:
+            Seconds waited for a free connection slot of a host at its
+            limit.
+        loop: The event loop the connections belong to.
+    '''
+
+    def __init__(self, max_per_host=8, idle_timeout=30, resolver=None,
+                 happy_eyeballs_delay=None, connect_timeout=10,
+                 acquire_timeout=30, loop=None):
+        '''
+        Initialization.
+        '''
+
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.resolver = resolver
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self.connect_timeout = connect_timeout
+        self.acquire_timeout = acquire_timeout
+        self.event_loop = loop or asyncio.get_event_loop()
+
+        # Idle connections of each host, the most recently used comes last
+        self.idle = dict()
+        # Number of open connections, idle or in use, of each host
+        self.open_count = dict()
+        # Waiting for a free connection slot of each host
+        self.conds = dict()
+
+
+    async def acquire(self, scheme, host, port):
+        """
+        Coroutine: Getting a connection to host, reusing an idle one if
+        possible, waiting if the host is at its connection limit.
+
+        Args:
+            scheme: 'http' or 'https'.
+            host: The host name.
+            port: The port.
+
+        Returns:
+            A tuple (reader, writer, reused).
+
+        Raises:
+            UpstreamTimeout: No slot became free, or connecting took too
+                             long.
+        """
+
+        key = (scheme, host, port)
+        cond = self.conds.get(key)
+        if cond is None:
+            cond = self.conds[key] = asyncio.Condition()
+
+        deadline = self.event_loop.time() + self.acquire_timeout
+
+        async with cond:
+            while True:
+                conn = self._pop_idle(key)
+                if conn is not None:
+                    return conn[0], conn[1], True
+
+                if self.open_count.get(key, 0) < self.max_per_host:
+                    self.open_count[key] = self.open_count.get(key, 0) + 1
+                    break
+
+                try:
+                    await asyncio.wait_for(
+                        cond.wait(), deadline - self.event_loop.time())
+                except asyncio.TimeoutError:
+                    raise UpstreamTimeout('No free connection to %s' % host)
+
+        # The slot is given back on any failure, cancellation included
+        try:
+            reader, writer = await asyncio.wait_for(
+                self._connect(scheme, host, port), self.connect_timeout)
+        except asyncio.TimeoutError:
+            await self._closed(key)
+            raise UpstreamTimeout('Connecting to %s timed out' % host)
+        except BaseException:
+            await self._closed(key)
+            raise
+
+        return reader, writer, False
+
+
+    async def release(self, scheme, host, port, reader, writer, reusable):
+        """
+        Coroutine: Returning a connection to the pool, closing it if it can
+        not be reused.
+
+        Args:
+            scheme: 'http' or 'https'.
+            host: The host name.
+            port: The port.
+            reader: StreamReader object of the connection.
+            writer: StreamWriter object of the connection.
+            reusable: Whether the response has been fully read and the web
+                      server keeps the connection alive.
+        """
+
+        key = (scheme, host, port)
+
+        if not reusable or reader.at_eof() or writer.transport.is_closing():
+            writer.close()
+            await self._closed(key)
+            return
+
+        conn = [reader, writer, None]
+        conn[2] = self.event_loop.call_later(self.idle_timeout,
+                                             self._expire, key, conn)
+        self.idle.setdefault(key, deque()).append(conn)
+
+        async with self.conds[key]:
+            self.conds[key].notify()
+
+
+    async def _connect(self, scheme, host, port):
+        """
+        Coroutine: Opening a new connection to host.
+
+        Args:
+            scheme: 'http' or 'https'.
+            host: The host name.
+            port: The port.
+
+        Returns:
+            A tuple (reader, writer).
+        """
+
+        ssl = (scheme == 'https')
+
+        if self.resolver is None:
+            return await asyncio.open_connection(host, port, ssl=ssl)
+
+        addrs = await self.resolver.resolve(host, port)
+        if not addrs:
+            raise socket.gaierror('No address for %s' % host)
+
+        # The host name is still needed for verifying the certificate
+        server_hostname = host if ssl else None
+
+        if self.happy_eyeballs_delay is None:
+            error = None
+            for family, sockaddr in addrs:
+                try:
+                    return await asyncio.open_connection(
+                        sockaddr[0], sockaddr[1], ssl=ssl, family=family,
+                        server_hostname=server_hostname)
+                except OSError as exc:
+                    error = exc
+            raise error
+
+        return await self._race(addrs, ssl, server_hostname)
+
+
+    async def _race(self, addrs, ssl, server_hostname):
+        """
+        Coroutine: Connecting with happy eyeballs, starting an attempt for
+        the next address whenever the delay passes or an attempt fails.
+        The first established connection wins, the others are closed.
+
+        Args:
+            addrs: The list of (family, sockaddr) tuples.
+            ssl: Whether to use TLS.
+            server_hostname: The host name for TLS, or None.
+
+        Returns:
+            A tuple (reader, writer).
+        """
+
+        pending = set()
+        remaining = list(addrs)
+        error = None
+        winner = None
+
+        try:
+            while winner is None and (pending or remaining):
+                if remaining:
+                    family, sockaddr = remaining.pop(0)
+                    pending.add(asyncio.ensure_future(asyncio.open_connection(
+                        sockaddr[0], sockaddr[1], ssl=ssl, family=family,
+                        server_hostname=server_hostname)))
+
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.happy_eyeballs_delay if remaining else None,
+                    return_when=asyncio.FIRST_COMPLETED)
+
+                for attempt in done:
+                    if attempt.exception() is not None:
+                        error = attempt.exception()
+                    elif winner is None:
+                        winner = attempt.result()
+                    else:
+                        attempt.result()[1].close()
+        finally:
+            for attempt in pending:
+                attempt.cancel()
+
+        if winner is None:
+            raise error
+
+        return winner
+
+
+    def _pop_idle(self, key):
+        """
+        Taking the most recently used live idle connection of a host.
+        Connections closed by the web server meanwhile are dropped.
+
+        Args:
+            key: The (scheme, host, port) tuple.
+
+        Returns:
+            The idle connection [reader, writer, handle], or None.
+        """
+
+        idle = self.idle.get(key)
+
+        while idle:
+            conn = idle.pop()
+            conn[2].cancel()
+            if conn[0].at_eof() or conn[1].transport.is_closing():
+                conn[1].close()
+                self.open_count[key] -= 1
+                continue
+            return conn
+
+        return None
+
+
+    def _expire(self, key, conn):
+        """
+        Closing a connection which has been idle for too long.
+
+        Args:
+            key: The (scheme, host, port) tuple.
+            conn: The idle connection.
+        """
+
+        idle = self.idle.get(key)
+        if idle is None or conn not in idle:
+            return
+
+        idle.remove(conn)
+        conn[1].close()
+        self.event_loop.create_task(self._closed(key))
+
+
+    async def _closed(self, key):
+        """
+        Coroutine: Releasing the slot of a closed connection, waking up one
+        waiter.
+
+        Args:
+            key: The (scheme, host, port) tuple.
+        """
+
+        self.open_count[key] -= 1
+
+        async with self.conds[key]:
+            self.conds[key].notify()
+
+
+    def close(self):
+        """
+        Closing all idle connections.
+        """
+
+        for key, idle in self.idle.items():
+            while idle:
+                conn = idle.pop()
+                conn[2].cancel()
+                conn[1].close()
+                self.open_count[key] -= 1
@@ -9,20 +9,37 @@
 #
 
 # Asynchronous IO support
+import argparse
 import asyncio
+import os
 import sys
+import time
+from signal import SIGTERM
 # HTTP content compression
 import gzip
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
 import urllib.parse
+from collections import Counter, OrderedDict
 
 # Memory cache support
 import hashlib
-from datetime import datetime, timedelta
-import copy
+from mem_cache import MemCache
+from shared_cache import SharedMemCache
+from disk_cache import DiskCache
+
+# Upstream connection pooling
+from conn_pool import ConnPool, UpstreamTimeout
+from dns_cache import DNSCache
+from http_parser import HTTPResponseParser
 
 # Daemonizing server
 from daemon_process import DaemonProcess
 
+# Instrumentation
+from metrics import Metrics
+
 
 class AsynCompressProxy(DaemonProcess):
     '''
@@ -30,9 +47,99 @@ class AsynCompressProxy(DaemonProcess):
 
     Args:
         port: The port to bind.
+        workers:
+            The number of pre-forked worker processes sharing the port with
+            SO_REUSEPORT. They share one memory cache in a shared memory
+            segment. Worker i keeps its disk cache in the subdirectory
+            worker-i of the disk cache directory, with a share of its
+            budget.
+        stats_port:
+            The local port serving the metrics in the Prometheus text
+            format, disabled if None. Worker i serves its own metrics on
+            stats_port + i.
+        cache_size: The byte budget of the memory cache.
+        cache_live: The time to live of a cached response, in seconds.
+        stale_while_revalidate:
+            Seconds after expiry during which a cached response is still
+            served immediately while being refreshed in background.
+        disk_cache_dir:
+            The directory of the persistent disk cache, which is disabled if
+            None.
+        disk_cache_size: The byte budget of the disk cache.
+        upstream_max_conns: The maximum number of connections to one host.
+        upstream_idle_timeout:
+            Seconds after which an idle connection to a host is closed.
+        upstream_connect_timeout:
+            Seconds for connecting to a web server, answered with 504
+            otherwise.
+        upstream_read_timeout:
+            Seconds a web server may be silent while sending a response,
+            answered with 504 otherwise.
+        upstream_acquire_timeout:
+            Seconds a request waits for a connection slot of a host at its
+            limit, answered with 504 otherwise.
+        dns_ttl: Seconds the resolved addresses of a host are cached.
+        dns_negative_ttl: Seconds a failed host name lookup is cached.
+        happy_eyeballs_delay:
+            Seconds before also trying the next address of a host while
+            connecting, or None for trying them one after another.
+        stream_mode: Forwarding missed responses to the client while they
+                     are being received, instead of buffering them first.
+        compress_executor:
+            Offloading compression to 'thread' or 'process' pool, or
+            compressing inside the event loop if None.
+        compress_workers: The number of compression workers.
+        compress_threshold:
+            Contents smaller than this number of bytes are always compressed
+            inside the event loop.
+        compress_level: The default compression level, from 1 to 9.
+        compress_levels:
+            A dict of compression levels for content types, such as
+            'text/html', 'text/*' or '*'.
+        write_buffer_high:
+            The write buffer size of a client connection above which no
+            more content is written until it drains.
+        write_buffer_low: The write buffer size writing resumes at.
+        write_timeout:
+            Seconds a client may take to drain its write buffer, it is
+            disconnected otherwise.
+        max_connections:
+            The maximum number of client connections, further ones are
+            answered with 503 and closed.
+        header_timeout: Seconds a client may take to send a request header.
+        body_timeout: Seconds a client may take to send a request content.
+        idle_timeout:
+            Seconds a kept alive client connection may be idle between
+            requests.
+        warmup_file:
+            A file of targets fetched into the cache at startup, one per
+            line, or an access log with quoted request lines. Disabled if
+            None.
+        warmup_top:
+            Warming up only the N most frequent targets of the file, or all
+            of them in order if None.
+        warmup_workers: The number of concurrent warm-up fetches.
+        warmup_blocking:
+            Finishing the warm-up before accepting clients, instead of
+            warming up while serving.
     '''
 
-    def __init__(self, port=8123):
+    def __init__(self, port=8123, workers=1, stats_port=None,
+                 cache_size=64 * 1024 * 1024,
+                 cache_live=3600, stale_while_revalidate=0,
+                 disk_cache_dir=None,
+                 disk_cache_size=1024 * 1024 * 1024, upstream_max_conns=8,
+                 upstream_idle_timeout=30, upstream_connect_timeout=10,
+                 upstream_read_timeout=30, upstream_acquire_timeout=30,
+                 dns_ttl=300, dns_negative_ttl=30,
+                 happy_eyeballs_delay=None, stream_mode=False,
+                 compress_executor=None, compress_workers=None,
+                 compress_threshold=65536, compress_level=9,
+                 compress_levels=None, write_buffer_high=64 * 1024,
+                 write_buffer_low=16 * 1024, write_timeout=60,
+                 max_connections=1024, header_timeout=10, body_timeout=30,
+                 idle_timeout=60, warmup_file=None, warmup_top=None,
+                 warmup_workers=8, warmup_blocking=False):
         '''
         Initialization.
         '''
@@ -46,23 +153,227 @@ class AsynCompressProxy(DaemonProcess):
 
         # Buffer size
         self.read_buf_size = 655360
-
-        # Initializing server coroutine
+        self.stream_chunk_size = 65536
+        self.stream_mode = stream_mode
+
+        # Flow control of client connections, the write buffer of each
+        # connection stays below high watermark plus one chunk
+        self.write_chunk_size = 65536
+        self.write_buffer_high = write_buffer_high
+        self.write_buffer_low = write_buffer_low
+        self.write_timeout = write_timeout
+
+        # Admission and shedding of client connections
+        self.conn_slots = asyncio.Semaphore(max_connections)
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.idle_timeout = idle_timeout
+
+        # Server setting
         self.host = ''
         self.port = port
-
-        self.server_coro = asyncio.start_server(self._req_handler,
-                                           self.host, self.port,
-                                           loop = self.event_loop)
+        self.workers = workers
+        self.stats_port = stats_port
 
         self.hash_tool = hashlib.md5
-        self.mem_cached = dict()
-        self.cache_live = timedelta(0, 3600, 0)
+        self.cache_live = cache_live
+        self.stale_while_revalidate = stale_while_revalidate
+        if workers > 1:
+            # Created before forking, so that all workers map it
+            self.mem_cached = SharedMemCache(
+                max_bytes=cache_size, ttl=self.cache_live,
+                stale_serve=self.stale_while_revalidate, loop=self.event_loop)
+        else:
+            self.mem_cached = MemCache(max_bytes=cache_size,
+                                       ttl=self.cache_live,
+                                       stale_serve=self.stale_while_revalidate,
+                                       loop=self.event_loop)
+
+        # Second tier, surviving restarts. Workers open their own after
+        # forking, so that none of them evicts the files of the others.
+        self.disk_cache_dir = disk_cache_dir
+        self.disk_cache_size = disk_cache_size
+        self.disk_cached = None
+        if disk_cache_dir is not None and workers == 1:
+            self.disk_cached = DiskCache(disk_cache_dir,
+                                         max_bytes=disk_cache_size,
+                                         ttl=self.cache_live,
+                                         loop=self.event_loop)
+
+        # Keep-alive connections to web servers, resolved once per TTL
+        self.dns_cache = DNSCache(ttl=dns_ttl, negative_ttl=dns_negative_ttl,
+                                  loop=self.event_loop)
+        self.conn_pool = ConnPool(max_per_host=upstream_max_conns,
+                                  idle_timeout=upstream_idle_timeout,
+                                  resolver=self.dns_cache,
+                                  happy_eyeballs_delay=happy_eyeballs_delay,
+                                  connect_timeout=upstream_connect_timeout,
+                                  acquire_timeout=upstream_acquire_timeout,
+                                  loop=self.event_loop)
+        self.upstream_read_timeout = upstream_read_timeout
+
+        # Fetches in flight, concurrent misses of one target share a future
+        self.in_flight = dict()
+
+        # Supported content codings, in order of preference
+        self.encodings = ('gzip', 'deflate')
+        self.compress_level = compress_level
+        self.compress_levels = compress_levels or dict()
+
+        # Compression executor. Workers create their own after forking,
+        # the queues of a process pool must not be shared across processes.
+        self.compress_threshold = compress_threshold
+        if compress_executor not in ('process', 'thread', None):
+            raise ValueError('Unknown compress executor: %s'
+                             % compress_executor)
+        self.compress_executor_type = compress_executor
+        self.compress_workers = compress_workers
+        self.compress_executor = None
+        if workers == 1:
+            self.compress_executor = self._new_compress_executor()
+
+        # Cache warm-up at startup
+        self.warmup_file = warmup_file
+        self.warmup_top = warmup_top
+        self.warmup_workers = warmup_workers
+        self.warmup_blocking = warmup_blocking
+
+        self.metrics = Metrics()
+        self._init_metrics()
+
+
+    def _new_compress_executor(self):
+        '''
+        Creating the compression executor, pool workers are spawned on first
+        use. Process workers are not forked, otherwise they would inherit
+        the client connections open at that moment and keep them alive.
+
+        Returns:
+            The executor, or None if compressing inside the event loop.
+        '''
+
+        if self.compress_executor_type == 'process':
+            return ProcessPoolExecutor(
+                self.compress_workers,
+                mp_context=multiprocessing.get_context('spawn'))
+        if self.compress_executor_type == 'thread':
+            return ThreadPoolExecutor(self.compress_workers)
+        return None
+
+
+    def _init_metrics(self):
+        '''
+        Registering the metrics of the proxy.
+        '''
+
+        latency_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1, 2.5, 5, 10)
+
+        self.metrics.counter('connections_total',
+                             'Client connections accepted.')
+        self.metrics.gauge('connections_open', 'Client connections open.')
+        self.metrics.counter('client_write_timeouts_total',
+                             'Clients disconnected for not reading.')
+        self.metrics.counter('client_read_timeouts_total',
+                             'Clients disconnected for not sending, by the '
+                             'part of the request awaited.')
+        self.metrics.counter('connections_rejected_total',
+                             'Client connections rejected at the limit.')
+        self.metrics.counter('requests_total',
+                             'Requests by the source of the response.')
+        self.metrics.histogram('request_seconds',
+                               'Time until a response is written.',
+                               latency_buckets)
+        self.metrics.counter('bytes_out_total', 'Bytes sent to clients.')
+        self.metrics.counter('origin_responses_total',
+                             'Responses of web servers by status.')
+        self.metrics.histogram('origin_fetch_seconds',
+                               'Time of a request to a web server.',
+                               latency_buckets)
+        self.metrics.counter('origin_bytes_in_total',
+                             'Bytes received from web servers.')
+        self.metrics.counter('origin_failures_total',
+                             'Requests answered with 502 or 504, by '
+                             'reason.')
+        self.metrics.histogram('compress_seconds',
+                               'Time of compressing a whole content.',
+                               latency_buckets)
+        self.metrics.counter('compress_bytes_in_total',
+                             'Content bytes before compression.')
+        self.metrics.counter('compress_bytes_out_total',
+                             'Content bytes after compression.')
+        self.metrics.gauge('compress_ratio',
+                           'Compressed bytes per uncompressed byte.')
+        self.metrics.counter('cache_hits_total', 'Cache hits by tier.')
+        self.metrics.counter('cache_misses_total', 'Cache misses by tier.')
+        self.metrics.counter('cache_evictions_total',
+                             'Cache evictions by tier.')
+        self.metrics.gauge('cache_hit_ratio', 'Cache hit ratio by tier.')
+        self.metrics.gauge('cache_entries', 'Cached entries by tier.')
+        self.metrics.gauge('cache_bytes', 'Cached bytes by tier.')
+        self.metrics.counter('cache_lock_timeouts_total',
+                             'Shared cache operations given up waiting for '
+                             'its lock.')
+        self.metrics.counter('warmup_fetches_total',
+                             'Warm-up fetches by result.')
+        self.metrics.counter('dns_hits_total', 'Host name cache hits.')
+        self.metrics.counter('dns_misses_total', 'Host name cache misses.')
+        self.metrics.counter('dns_failures_total',
+                             'Failed host name lookups.')
+        self.metrics.gauge('dns_entries', 'Cached host names.')
+        self.metrics.gauge('in_flight_fetches',
+                           'Fetches from web servers in flight.')
+
+        self.metrics.add_collector(self._collect_metrics)
+
+
+    def _collect_metrics(self, metrics):
+        '''
+        Copying the cache counters and the derived ratios into the metrics
+        before they are rendered.
+
+        Args:
+            metrics: The metrics registry.
+        '''
+
+        tiers = [('memory', self.mem_cached)]
+        if self.disk_cached is not None:
+            tiers.append(('disk', self.disk_cached))
+
+        for tier, cache in tiers:
+            stats = cache.stats()
+            lookups = stats['hits'] + stats['misses']
+            metrics.set('cache_hits_total', stats['hits'], tier=tier)
+            metrics.set('cache_misses_total', stats['misses'], tier=tier)
+            metrics.set('cache_evictions_total', stats['evictions'],
+                        tier=tier)
+            metrics.set('cache_hit_ratio',
+                        stats['hits'] / lookups if lookups else 0.0,
+                        tier=tier)
+            metrics.set('cache_entries', stats['entries'], tier=tier)
+            metrics.set('cache_bytes', stats['bytes'], tier=tier)
+            if 'lock_timeouts' in stats:
+                metrics.set('cache_lock_timeouts_total',
+                            stats['lock_timeouts'])
+
+        c_in = metrics.metrics['compress_bytes_in_total'][2].get((), 0)
+        c_out = metrics.metrics['compress_bytes_out_total'][2].get((), 0)
+        metrics.set('compress_ratio', c_out / c_in if c_in else 0.0)
+
+        dns_stats = self.dns_cache.stats()
+        metrics.set('dns_hits_total', dns_stats['hits'])
+        metrics.set('dns_misses_total', dns_stats['misses'])
+        metrics.set('dns_failures_total', dns_stats['failures'])
+        metrics.set('dns_entries', dns_stats['entries'])
+
+        metrics.set('in_flight_fetches', len(self.in_flight))
 
 
     async def _req_handler(self, reader, writer):
         """
-        Coroutine: Handling the HTTP request.
+        Coroutine: Handling the HTTP requests of a client connection.
+        The connection is kept alive between requests if the client asks for
+        it, pipelined requests are answered in order.
 
         Args:
             reader:
@@ -71,224 +382,1313 @@ class AsynCompressProxy(DaemonProcess):
                 StreamWriter object, utilized to write response to client.
         """
 
-        # Reading raw request data from reader (type SreamReader)
-        req_raw = await reader.readline()
-        req_content = req_raw.decode()
+        self.metrics.inc('connections_total')
+
+        # Shedding load instead of queueing, the client may retry later
+        if self.conn_slots.locked():
+            self.metrics.inc('connections_rejected_total')
+            writer.write(b'HTTP/1.1 503 Service Unavailable\r\n'
+                         b'Content-Length: 0\r\n'
+                         b'Connection: close\r\n\r\n')
+            writer.close()
+            return
+
+        await self.conn_slots.acquire()
+        self.metrics.inc('connections_open')
+
+        writer.transport.set_write_buffer_limits(self.write_buffer_high,
+                                                 self.write_buffer_low)
+
+        first = True
+
+        try:
+            while True:
+                # Reading raw request data from reader (type SreamReader)
+                try:
+                    req_raw = await self._read_header(reader, writer, first)
+                except (asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError, ConnectionError):
+                    break
+                req_content = req_raw.decode('utf-8')
+                first = False
+
+                # Getting method, target address and HTTP version
+                req_line = req_content.split('\r\n', 1)[0].split(' ')
+                if len(req_line) != 3:
+                    break
+                method, target, version = req_line
+
+                fields = self._parse_header(req_content)
+                keep_alive = self._is_keep_alive(version, fields)
+
+                # Discarding request content
+                if 'content-length' in fields:
+                    try:
+                        await self._discard_body(
+                            reader, writer, int(fields['content-length']))
+                    except (asyncio.IncompleteReadError, ConnectionError):
+                        break
+
+                # Only GET and HEAD are proxied, both fetched as GET
+                if method not in ('GET', 'HEAD'):
+                    self.metrics.inc('requests_total', source='unsupported')
+                    await self._write_resp(
+                        writer, (b'HTTP/1.1 501 Not Implemented\r\n'
+                                 b'Content-Length: 0\r\n', b''), False)
+                    break
+
+                # Each content coding is cached as a variant of its own
+                encoding = self._negotiate_encoding(
+                    fields.get('accept-encoding'))
+
+                # Streamed responses are delimited with chunked encoding
+                # on persistent connections, only HTTP/1.1 supports it
+                chunked = keep_alive and version == 'HTTP/1.1'
+
+                # Responsing compressed content
+                start = time.monotonic()
+                keep_alive = await self._get_response(target, encoding,
+                                                      writer, keep_alive,
+                                                      chunked,
+                                                      method == 'HEAD')
+                self.metrics.observe('request_seconds',
+                                     time.monotonic() - start)
+                if not keep_alive:
+                    break
+        except asyncio.TimeoutError:
+            # Client not reading its responses
+            self.metrics.inc('client_write_timeouts_total')
+        except (ConnectionError, UpstreamTimeout):
+            # Including web servers timing out during a streamed response
+            pass
+        finally:
+            self.metrics.inc('connections_open', -1)
+            self.conn_slots.release()
+            writer.close()
+
+
+    async def _read_header(self, reader, writer, first):
+        """
+        Coroutine: Reading a request header. A kept alive connection may be
+        idle until the request begins, then the header must be complete
+        in time.
+
+        Args:
+            reader: StreamReader object of the client.
+            writer: StreamWriter object of the client.
+            first: Whether it is the first request of the connection.
+
+        Returns:
+            The raw request header.
+        """
+
+        # Timers abort the connection, making the pending read fail
+        if first:
+            timer = self._start_timer(writer, self.header_timeout, 'header')
+        else:
+            timer = self._start_timer(writer, self.idle_timeout, 'idle')
+            try:
+                start = await reader.readexactly(1)
+            finally:
+                timer.cancel()
+            timer = self._start_timer(writer, self.header_timeout, 'header')
+
+        try:
+            req_raw = await reader.readuntil(b'\r\n\r\n')
+        finally:
+            timer.cancel()
+
+        return req_raw if first else start + req_raw
+
+
+    async def _discard_body(self, reader, writer, length):
+        """
+        Coroutine: Reading and discarding a request content piece by piece.
+
+        Args:
+            reader: StreamReader object of the client.
+            writer: StreamWriter object of the client.
+            length: The content length.
+        """
+
+        timer = self._start_timer(writer, self.body_timeout, 'body')
+
+        try:
+            while length > 0:
+                data = await reader.read(min(length, self.read_buf_size))
+                if not data:
+                    raise asyncio.IncompleteReadError(b'', length)
+                length -= len(data)
+        finally:
+            timer.cancel()
+
+
+    def _start_timer(self, writer, timeout, part):
+        """
+        Starting a timer disconnecting a client which is too slow.
+
+        Args:
+            writer: StreamWriter object of the client.
+            timeout: Seconds until disconnecting.
+            part: The part of the request awaited, for the counter.
+
+        Returns:
+            The TimerHandle object, to be cancelled once the part is read.
+        """
+
+        return self.event_loop.call_later(timeout, self._shed_client, writer,
+                                          part)
+
+
+    def _shed_client(self, writer, part):
+        """
+        Disconnecting a client which didn't send in time.
+
+        Args:
+            writer: StreamWriter object of the client.
+            part: The part of the request awaited.
+        """
+
+        self.metrics.inc('client_read_timeouts_total', part=part)
+        writer.transport.abort()
+
+
+    async def _write_resp(self, writer, resp, keep_alive, head=False):
+        """
+        Coroutine: Writing a compressed response to client in chunks, so
+        that a slow client holds at most the write buffer limit instead of
+        a copy of the whole content.
+
+        Args:
+            writer: StreamWriter object of the client.
+            resp: The compressed response tuple (resp_hdr, resp_cont).
+            keep_alive: Whether the connection is kept alive afterwards.
+            head: Whether answering a HEAD request, with the header only.
+        """
+
+        if head:
+            resp = (resp[0], b'')
+
+        connection = b'Connection: keep-alive\r\n\r\n' if keep_alive \
+            else b'Connection: close\r\n\r\n'
+
+        writer.write(resp[0])
+        writer.write(connection)
+
+        # Slices of the cached content are not copied
+        content = memoryview(resp[1])
+        for pos in range(0, len(content), self.write_chunk_size):
+            writer.write(content[pos:pos + self.write_chunk_size])
+            await self._drain(writer)
+
+        self.metrics.inc('bytes_out_total',
+                         len(resp[0]) + len(connection) + len(resp[1]))
+
+
+    async def _drain(self, writer):
+        """
+        Coroutine: Waiting for the write buffer of a client to drain below
+        low watermark, if it has reached high watermark.
+
+        Args:
+            writer: StreamWriter object of the client.
+
+        Raises:
+            asyncio.TimeoutError: The client doesn't read in time.
+        """
+
+        if writer.transport.get_write_buffer_size() <= self.write_buffer_high:
+            return
+
+        await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+
+    def _is_keep_alive(self, version, fields):
+        """
+        Checking whether the connection persists after a message.
+
+        Args:
+            version: The HTTP version of the message.
+            fields: The parsed header fields of the message.
+
+        Returns:
+            True if the connection is kept alive.
+        """
+
+        connection = fields.get('connection',
+                                fields.get('proxy-connection', '')).lower()
 
-        # Getting target address
-        target = req_content.split(' ')[1]
+        if version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
 
-        # Getting compressed response
-        resp = await self._get_response(target)
 
-        # Responsing
-        writer.write(resp)
-        await writer.drain()
+    def _negotiate_encoding(self, accept_encoding):
+        """
+        Selecting the content coding according to the Accept-Encoding field.
 
-        writer.close()
+        Args:
+            accept_encoding: The field value, or None if it is missing.
 
+        Returns:
+            'gzip', 'deflate' or 'identity'.
+        """
 
-    async def _get_response(self, target):
+        # Clients not telling anything get gzip as before
+        if accept_encoding is None:
+            return self.encodings[0]
+
+        qvalues = dict()
+        for item in accept_encoding.split(','):
+            name, _, params = item.partition(';')
+            qvalue = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    qvalue = float(params[2:])
+                except ValueError:
+                    qvalue = 0.0
+            qvalues[name.strip().lower()] = qvalue
+
+        best, best_qvalue = 'identity', 0.0
+        for encoding in self.encodings:
+            qvalue = qvalues.get(encoding, qvalues.get('*', 0.0))
+            if qvalue > best_qvalue:
+                best, best_qvalue = encoding, qvalue
+
+        return best
+
+
+    async def _get_response(self, target, encoding, writer, keep_alive,
+                            chunked, head=False):
         """
-        Getting response. From memory or from web server.
+        Getting response and writing it to client. From memory, from disk or
+        from web server.
 
         Args:
             target: The target address.
+            encoding: The content coding.
+            writer: StreamWriter object of the client.
+            keep_alive: Whether the client keeps the connection alive.
+            chunked: Whether a streamed response uses chunked encoding.
+            head: Whether answering a HEAD request, with the header of the
+                  cached GET response.
 
         Returns:
-            The response is a tuple in form of (resp_hdr, resp_cont)
+            True if the connection is kept alive afterwards.
         """
 
+        # Hashing once, the key is passed on to every tier
+        key = self._calc_hash(target, encoding)
+
         # Checking if record already exists, if not, requesting from web server
-        resp = self._get_mem_cache(target)
+        resp = self._get_mem_cache(key)
+        source = 'memory'
+
+        # Serving a recently expired record, refreshing it in background,
+        # unless it must be revalidated first. Only its metadata is copied
+        # until it is known to be served.
+        meta = None
+        if resp is None and (self.stale_while_revalidate or self.stream_mode):
+            meta = self.mem_cached.peek(key)
+        if meta is not None and self.stale_while_revalidate \
+                and not meta[2] and meta[1] <= self.stale_while_revalidate:
+            stale = self.mem_cached.get_stale(key)
+            if stale is not None:
+                self._start_fetch(target, encoding, key)
+                resp = stale[0]
+                source = 'stale'
+
+        if resp is None and self.disk_cached is not None:
+            disk_resp = await self.disk_cached.get(key)
+            if disk_resp is not None:
+                self.metrics.inc('requests_total', source='disk')
+                await self._send_disk_resp(writer, disk_resp, keep_alive,
+                                           head)
+                return keep_alive
 
         if resp is None:
+            # Streaming the response if nobody is fetching it yet, expired
+            # entries are revalidated instead
+            if self.stream_mode and not head \
+                    and key not in self.in_flight \
+                    and meta is None:
+                self.metrics.inc('requests_total', source='stream')
+                await self._stream_remote(target, encoding, key, writer,
+                                          chunked)
+                return chunked
+
+            try:
+                resp = await self._get_shared_fetch(target, encoding, key)
+            except (UpstreamTimeout, OSError) as error:
+                self.metrics.inc('requests_total', source='error')
+                await self._write_gateway_error(writer, error, keep_alive)
+                return keep_alive
+            source = 'origin'
+
+        self.metrics.inc('requests_total', source=source)
+
+        await self._write_resp(writer, resp, keep_alive, head)
+
+        return keep_alive
+
+
+    async def _write_gateway_error(self, writer, error, keep_alive):
+        """
+        Coroutine: Answering a request the web server failed on, with 504 if
+        it timed out, or else with 502.
+
+        Args:
+            writer: StreamWriter object of the client.
+            error: The exception raised by the fetch.
+            keep_alive: Whether the connection is kept alive afterwards.
+        """
+
+        if isinstance(error, UpstreamTimeout):
+            status, reason = b'504 Gateway Timeout', 'timeout'
+        else:
+            status, reason = b'502 Bad Gateway', 'error'
+
+        self.metrics.inc('origin_failures_total', reason=reason)
+
+        await self._write_resp(writer, (b'HTTP/1.1 %s\r\n'
+                                        b'Content-Length: 0\r\n' % status,
+                                        b''), keep_alive)
+
+
+    async def _send_disk_resp(self, writer, disk_resp, keep_alive,
+                              head=False):
+        """
+        Coroutine: Writing a response cached on disk to client, the content
+        is sent with sendfile if the event loop supports it.
+
+        Args:
+            writer: StreamWriter object of the client.
+            disk_resp: The tuple (resp_hdr, cache_file, offset, count).
+            keep_alive: Whether the connection is kept alive afterwards.
+            head: Whether answering a HEAD request, with the header only.
+
+        Raises:
+            asyncio.TimeoutError: The client doesn't read in time.
+        """
+
+        resp_hdr, cache_file, offset, count = disk_resp
+
+        with cache_file:
+            await self._write_resp(writer, (resp_hdr, b''), keep_alive)
+            if head:
+                return
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+            if hasattr(self.event_loop, 'sendfile'):
+                await asyncio.wait_for(
+                    self.event_loop.sendfile(writer.transport, cache_file,
+                                             offset, count),
+                    self.write_timeout)
+            else:
+                cache_file.seek(offset)
+                remaining = count
+                while remaining:
+                    data = cache_file.read(min(remaining,
+                                               self.write_chunk_size))
+                    if not data:
+                        break
+                    writer.write(data)
+                    remaining -= len(data)
+                    await self._drain(writer)
+
+        self.metrics.inc('bytes_out_total', count)
+
+
+    async def _get_shared_fetch(self, target, encoding, key):
+        """
+        Getting response from web server, joining the fetch already in flight
+        for the same target if there is one.
+
+        Args:
+            target: The target address.
+            encoding: The content coding.
+            key: The cache key.
+
+        Returns:
+            The compressed response.
+        """
+
+        fetch = self._start_fetch(target, encoding, key)
+
+        # Shielding, so that one client leaving doesn't cancel the others
+        resp = await asyncio.shield(fetch)
+
+        # A streamed response not cached, fetching it again. The stream is
+        # no longer in flight, the waiters share one new fetch.
+        if resp is None:
+            resp = await asyncio.shield(
+                self._start_fetch(target, encoding, key))
+
+        return resp
+
+
+    def _start_fetch(self, target, encoding, key):
+        """
+        Starting a fetch from web server, unless one for the same target is
+        already in flight.
+
+        Args:
+            target: The target address.
+            encoding: The content coding.
+            key: The cache key.
+
+        Returns:
+            The future of the fetch in flight.
+        """
+
+        fetch = self.in_flight.get(key)
+
+        if fetch is None:
+            fetch = asyncio.ensure_future(self._fetch(target, encoding, key),
+                                          loop=self.event_loop)
+            self.in_flight[key] = fetch
+            fetch.add_done_callback(lambda _: self.in_flight.pop(key, None))
+            # Nobody may wait for a background refresh, retrieving errors
+            fetch.add_done_callback(
+                lambda done: done.cancelled() or done.exception())
+
+        return fetch
+
+
+    async def _fetch(self, target, encoding, key):
+        """
+        Requesting, compressing and caching the response from web server.
+        An expired entry with validators is revalidated by a conditional
+        request, and reused if the web server answers 304 Not Modified.
+
+        Args:
+            target: The target address.
+            encoding: The content coding.
+            key: The cache key.
+
+        Returns:
+            The compressed response.
+        """
+
+        meta = self.mem_cached.peek(key)
+        validators = meta[0] if meta is not None else None
+
+        resp = await self._get_remote(target, validators)
+
+        if meta is not None and resp[0].split(' ', 2)[1] == '304':
+            # Copying the response only now that it is reused
+            stale = self.mem_cached.get_stale(key)
+            if stale is not None:
+                # The lifetime is the one of the stored status
+                status = stale[0][0].split(b' ', 2)[1].decode('latin-1')
+                ttl = self._cache_policy(resp[0], status)[0]
+                if ttl is None:
+                    self.mem_cached.remove(key)
+                else:
+                    self.mem_cached.refresh(key, ttl)
+                return stale[0]
+            # Overwritten meanwhile, requesting it in full
             resp = await self._get_remote(target)
-            resp = self._compress_resp(resp)
-            self._add_mem_cache(target, resp)
+
+        ttl, validators, revalidate = self._cache_policy(resp[0])
+
+        resp = await self._compress_resp(resp, encoding)
+        if ttl is not None:
+            self._add_mem_cache(key, resp, ttl, validators, revalidate)
+            self._add_disk_cache(key, resp, ttl)
 
         return resp
 
 
-    def _get_mem_cache(self, target):
+    def _cache_policy(self, resp_hdr, status=None):
+        """
+        Getting the caching policy of a response from its status and its
+        Cache-Control, Age, ETag and Last-Modified fields.
+
+        Args:
+            resp_hdr: The response header from web server.
+            status:
+                The status the policy applies to, the one of resp_hdr if
+                None. A 304 response renews the stored response.
+
+        Returns:
+            A tuple (ttl, validators, revalidate), where ttl is None if the
+            response must not be cached, validators is a dict of the ETag
+            and Last-Modified fields or None, and revalidate tells whether
+            the response must not be served stale.
+        """
+
+        fields = self._parse_header(resp_hdr)
+
+        directives = dict()
+        for item in fields.get('cache-control', '').lower().split(','):
+            name, _, value = item.strip().partition('=')
+            directives[name] = value.strip('"')
+
+        if 'no-store' in directives or 'private' in directives:
+            return (None, None, False)
+
+        validators = dict()
+        for name in ('etag', 'last-modified'):
+            if name in fields:
+                validators[name] = fields[name]
+        validators = validators or None
+
+        # Statuses cached without an explicit lifetime
+        heuristic = ('200', '203', '204', '300', '301', '404', '405', '410',
+                     '414', '501')
+        if status is None:
+            status = (resp_hdr.split('\r\n', 1)[0].split(' ') + [''])[1]
+
+        # Shared cache lifetime first, then the fixed one
+        ttl = None
+        for name in ('s-maxage', 'max-age'):
+            if directives.get(name, '').isdigit():
+                ttl = int(directives[name])
+                break
+        if ttl is None:
+            if status not in heuristic:
+                return (None, None, False)
+            ttl = self.cache_live
+        if 'no-cache' in directives:
+            ttl = 0
+
+        # Time already spent in other caches
+        if fields.get('age', '').isdigit():
+            ttl = max(0, ttl - int(fields['age']))
+
+        # Useless without validators
+        if ttl == 0 and validators is None:
+            return (None, None, False)
+
+        revalidate = ttl == 0 or 'must-revalidate' in directives \
+            or 'proxy-revalidate' in directives
+
+        return (ttl, validators, revalidate)
+
+
+    def _get_mem_cache(self, key):
         """
         Getting response from cached data in memory.
 
         Args:
-            target: The target address.
+            key: The cache key.
 
         Returns:
             The response is a tuple in form of (resp_hdr, resp_cont)
         """
 
-        key = self._calc_hash(target)
-        if key not in self.mem_cached \
-                or self.mem_cached[key]['last'] \
-                + self.cache_live < datetime.now():
-            return None
-        else:
-            return self.mem_cached[key]['content']
+        return self.mem_cached.get(key)
 
 
-    def _add_mem_cache(self, target, value):
+    def _add_mem_cache(self, key, value, ttl=None, validators=None,
+                       revalidate=False):
         """
         Adding new record into memory cache.
 
         Args:
-            target: The target address.
+            key: The cache key.
             value: The compressed data.
+            ttl: The time to live in seconds, the default one if None.
+            validators: A dict of the ETag and Last-Modified fields.
+            revalidate: Whether the entry must not be served stale.
         """
 
-        key = self._calc_hash(target)
-        self.mem_cached[key] = dict()
-        self.mem_cached[key]['last'] = datetime.now()
-        self.mem_cached[key]['content'] = copy.deepcopy(value)
+        self.mem_cached.put(key, value, ttl, validators, revalidate)
 
 
-    def _calc_hash(self, target):
+    def _add_disk_cache(self, key, value, ttl=None):
         """
-        Calculating hash of input address.
+        Adding new record into disk cache in background, if enabled.
+
+        Args:
+            key: The cache key.
+            value: The compressed data.
+            ttl: The time to live in seconds, the default one if None.
+        """
+
+        if self.disk_cached is not None:
+            self.event_loop.create_task(self.disk_cached.put(key, value, ttl))
+
+
+    def _calc_hash(self, target, encoding):
+        """
+        Calculating hash of input address, suffixed by the content coding of
+        the cached variant. Computed once per request and passed on.
 
         Args:
             target: The target address.
+            encoding: The content coding.
         """
 
-        return self.hash_tool(target.encode()).hexdigest()
+        return '%s-%s' % (self.hash_tool(target.encode()).hexdigest(),
+                          encoding)
 
 
-    async def _get_remote(self, target):
+    async def _get_remote(self, target, validators=None):
         """
         Getting response from web server.
 
         Args:
             target: The target address.
+            validators:
+                A dict of the ETag and Last-Modified fields of a cached
+                response, making the request conditional.
 
         Returns:
-            The response is a tuple in form of (resp_hdr, resp_cont)
+            The response is a tuple in form of (resp_hdr, resp_cont), where
+            resp_cont is the content in bytes
+        """
+
+        resp_hdr = []
+        resp_cont = []
+
+        async def on_header(hdr):
+            resp_hdr.append(hdr)
+
+        async def on_chunk(chunk):
+            resp_cont.append(chunk)
+
+        await self._request_remote(target, on_header, on_chunk, validators)
+
+        return (resp_hdr[0], b''.join(resp_cont))
+
+
+    async def _request_remote(self, target, on_header, on_chunk,
+                              validators=None):
+        """
+        Coroutine: Requesting target from web server over a pooled keep-alive
+        connection. The response header and the pieces of the content are
+        passed to the callbacks as soon as they are received.
+
+        Args:
+            target: The target address.
+            on_header: Coroutine function called with the response header.
+            on_chunk: Coroutine function called with each piece of content.
+            validators:
+                A dict of the ETag and Last-Modified fields of a cached
+                response, making the request conditional.
+
+        Raises:
+            UpstreamTimeout: No connection, or no data in time.
         """
 
         # Parsing url into different parts
         url = urllib.parse.urlsplit(target)
-
-        # Setting up connection according to protocol type
-        conn = asyncio.open_connection(url.hostname, 443, ssl=True) \
-            if url.scheme == 'https' else \
-            asyncio.open_connection(url.hostname, 80)
-        reader, writer = await conn
+        port = url.port or (443 if url.scheme == 'https' else 80)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
 
         # Assembling request header
-        req = ('GET {path} HTTP/1.0\r\n'
-               'Host: {hostname} \r\n'
-               '\r\n').format(path = url.path or '/', hostname = url.hostname)
+        req = ('GET {path} HTTP/1.1\r\n'
+               'Host: {hostname}\r\n'
+               'Connection: keep-alive\r\n').format(path = path,
+                                                     hostname = url.hostname)
+        if validators is not None:
+            if 'etag' in validators:
+                req += 'If-None-Match: %s\r\n' % validators['etag']
+            if 'last-modified' in validators:
+                req += 'If-Modified-Since: %s\r\n' \
+                    % validators['last-modified']
+        req = (req + '\r\n').encode('utf-8')
+
+        start = time.monotonic()
 
-        # Sending request
-        writer.write(req.encode('utf-8'))
+        while True:
+            reader, writer, reused = await self.conn_pool.acquire(
+                url.scheme, url.hostname, port)
+            reusable = False
+
+            parser = HTTPResponseParser()
+            header_pending = True
+            retry = False
+
+            try:
+                # Sending request
+                writer.write(req)
+
+                while not parser.done:
+                    try:
+                        data = await asyncio.wait_for(
+                            reader.read(self.stream_chunk_size),
+                            self.upstream_read_timeout)
+                    except ConnectionError:
+                        data = b''
+                    except asyncio.TimeoutError:
+                        # The connection is closed when released
+                        raise UpstreamTimeout('%s timed out' % url.hostname)
+
+                    if not data:
+                        # Pooled connection closed by web server meanwhile
+                        if reused and not parser.received:
+                            retry = True
+                            break
+                        parser.eof()
+                        break
+
+                    chunks = parser.feed(data)
+
+                    # Header is passed once it is complete
+                    if parser.header is not None and header_pending:
+                        header_pending = False
+                        await on_header(parser.header.decode('latin-1'))
+
+                    for chunk in chunks:
+                        await on_chunk(chunk)
+
+                if retry:
+                    continue
+
+                # Bytes following the response make the connection unusable
+                reusable = parser.keep_alive and not parser.extra
+
+                self.metrics.observe('origin_fetch_seconds',
+                                     time.monotonic() - start)
+                self.metrics.inc('origin_responses_total',
+                                 status=parser.status)
+                return
+            finally:
+                self.metrics.inc('origin_bytes_in_total', parser.received)
+                await self.conn_pool.release(url.scheme, url.hostname, port,
+                                             reader, writer, reusable)
+
+
+    def _parse_header(self, resp_hdr):
+        """
+        Parsing the header fields.
 
-        # Reading response
-        resp_hdr = ''
-        resp_cont = ''
-        content_flag = False
+        Args:
+            resp_hdr: The request or response header.
 
-        while True:
-            line = await reader.readline()
-            if not line:
-                break
-            else:
-                if content_flag:
-                    resp_cont += line.decode('utf-8').rstrip()
-                else:
-                    if line.decode('utf-8') \
-                            == '<?xml version="1.0" encoding="utf-8"?>\n':
-                        content_flag = True
-                        resp_cont += line.decode('utf-8').rstrip()
-                    else:
-                        resp_hdr += line.decode('utf-8')
+        Returns:
+            A dict of the fields, with lower case field names.
+        """
+
+        fields = dict()
 
-        return (resp_hdr, resp_cont)
+        for line in resp_hdr.split('\r\n')[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                fields[name.strip().lower()] = value.strip()
 
+        return fields
 
-    def _compress_resp(self, resp):
+
+    async def _stream_remote(self, target, encoding, key, client_writer,
+                             chunked):
         """
-        Compressing the response content.
+        Coroutine: Forwarding the response from web server to client while it
+        is being received, compressing the content incrementally.
+        The compressed response is cached if it fits into the memory cache.
+
+        Args:
+            target: The target address.
+            encoding: The content coding.
+            key: The cache key.
+            client_writer: StreamWriter object of the client.
+            chunked:
+                Whether to use chunked encoding and keep the connection
+                alive, otherwise the end of content is marked by closing
+                the connection.
+        """
+
+        # Registering as in flight, so that concurrent misses wait for us
+        fetch = self.event_loop.create_future()
+        self.in_flight[key] = fetch
+
+        # Keeping a copy for caching while it fits into the cache
+        cached_hdr = []
+        cached = []
+        cached_len = 0
+
+        # Created once the content type is known
+        compressor = None
+        policy = None
+        has_body = True
+
+        async def forward(c_chunk):
+            nonlocal cached, cached_len
+
+            if chunked:
+                client_writer.write(b'%x\r\n' % len(c_chunk))
+                client_writer.write(c_chunk)
+                client_writer.write(b'\r\n')
+            else:
+                client_writer.write(c_chunk)
+            self.metrics.inc('bytes_out_total', len(c_chunk))
+            self.metrics.inc('compress_bytes_out_total', len(c_chunk))
+            await self._drain(client_writer)
+
+            if cached is not None:
+                cached.append(c_chunk)
+                cached_len += len(c_chunk)
+                if cached_len > self.mem_cached.max_bytes:
+                    cached = None
+
+        async def on_header(resp_hdr):
+            nonlocal compressor, policy, has_body
+            has_body = self._has_body(resp_hdr)
+            if has_body:
+                compressor = self._new_compressor(
+                    encoding, self._compress_level(resp_hdr))
+            policy = self._cache_policy(resp_hdr)
+
+            # Length of the compressed content is not known yet
+            resp_hdr = self._modify_header(resp_hdr, encoding)
+            resp_hdr = resp_hdr.encode('latin-1')
+            cached_hdr.append(resp_hdr)
+
+            client_writer.write(resp_hdr)
+            self.metrics.inc('bytes_out_total', len(resp_hdr))
+            if not has_body:
+                client_writer.write(b'Connection: keep-alive\r\n\r\n'
+                                    if chunked else
+                                    b'Connection: close\r\n\r\n')
+            elif chunked:
+                client_writer.write(b'Transfer-Encoding: chunked\r\n'
+                                    b'Connection: keep-alive\r\n\r\n')
+            else:
+                client_writer.write(b'Connection: close\r\n\r\n')
+
+        async def on_chunk(chunk):
+            self.metrics.inc('compress_bytes_in_total', len(chunk))
+            c_chunk = chunk if compressor is None \
+                else compressor.compress(chunk)
+            if c_chunk:
+                await forward(c_chunk)
+
+        resp = None
+        try:
+            try:
+                await self._request_remote(target, on_header, on_chunk)
+            except (UpstreamTimeout, OSError) as error:
+                # Failed before anything was sent, the client gets an error
+                # response instead
+                if cached_hdr:
+                    raise
+                await self._write_gateway_error(client_writer, error, chunked)
+                return
+
+            if compressor is not None:
+                await forward(compressor.flush())
+
+            if chunked and has_body:
+                client_writer.write(b'0\r\n\r\n')
+                await client_writer.drain()
+
+            if cached is not None and policy[0] is not None:
+                resp_cont = b''.join(cached)
+                resp_hdr = cached_hdr[0]
+                if has_body:
+                    resp_hdr += b'Content-Length: %d\r\n' % len(resp_cont)
+                resp = (resp_hdr, resp_cont)
+                self._add_mem_cache(key, resp, *policy)
+                self._add_disk_cache(key, resp, policy[0])
+        finally:
+            self.in_flight.pop(key, None)
+            fetch.set_result(resp)
+
+
+    async def _compress_resp(self, resp, encoding):
+        """
+        Coroutine: Compressing the response content.
 
         Args:
             resp:
                 The response, it is a tuple in form of (resp_hdr, resp_cont),
                 where resp_hdr is the response header, and resp_cont is the
                 response content.
+            encoding: The content coding.
 
         Returns:
-            A combined response, including modified header and
-            compressed content.
+            The compressed response tuple (resp_hdr, resp_cont), where
+            resp_hdr is the modified header without the Connection field and
+            the terminating empty line.
         """
 
-        print('Header Before: %d' % len(resp[0]))
-        print('Content Before: %d' % len(resp[1]))
+        # Nothing to compress, the header is forwarded as it is
+        if not self._has_body(resp[0]):
+            return (self._modify_header(resp[0], encoding).encode('latin-1'),
+                    b'')
+
         # Compressing content and get the compressed size
-        c_resp_cont = gzip.compress(resp[1].encode('utf-8'))
+        start = time.monotonic()
+        c_resp_cont = await self._compress(resp[1], encoding,
+                                           self._compress_level(resp[0]))
         c_resp_cont_len = len(c_resp_cont)
 
+        self.metrics.observe('compress_seconds', time.monotonic() - start)
+        self.metrics.inc('compress_bytes_in_total', len(resp[1]))
+        self.metrics.inc('compress_bytes_out_total', c_resp_cont_len)
+
         # Modifying response header
-        new_resp_hdr = resp[0].split('\r\n')
-        content_encoding_flag = True
-        encoding_field = 'Content-Encoding: gzip'
-
-        for idx in range(len(new_resp_hdr)):
-            item = new_resp_hdr[idx]
-            if item.startswith('Content-Length: '):
-                new_resp_hdr[idx] = 'Content-Length: %d' % c_resp_cont_len
-            elif item.startswith('Content-Encoding: '):
-                content_encoding_flag = False
-                new_resp_hdr[idx] = encoding_field
-            else:
-                continue
+        new_resp_hdr = self._modify_header(resp[0], encoding, c_resp_cont_len)
 
-        if content_encoding_flag:
-            new_resp_hdr.insert(-3, encoding_field)
+        return (new_resp_hdr.encode('latin-1'), c_resp_cont)
 
-        # Joining the header and the content.
-        new_resp_hdr = '\r\n'.join(new_resp_hdr)
-        print('Header Length: %d' % len(new_resp_hdr))
-        print('Content Length: %d' % c_resp_cont_len)
 
-        return b''.join([new_resp_hdr.encode('utf-8'), c_resp_cont])
+    async def _compress(self, data, encoding, level):
+        """
+        Coroutine: Compressing data, in the compression executor if the data
+        is large enough.
+
+        Args:
+            data: The bytes to be compressed.
+            encoding: The content coding.
+            level: The compression level.
+
+        Returns:
+            The compressed bytes.
+        """
+
+        if encoding == 'identity':
+            return data
+
+        # zlib format for deflate, as HTTP specifies it
+        compress = gzip.compress if encoding == 'gzip' else zlib.compress
+
+        if self.compress_executor is None \
+                or len(data) < self.compress_threshold:
+            return compress(data, level)
+
+        return await self.event_loop.run_in_executor(self.compress_executor,
+                                                     compress, data, level)
+
+
+    def _new_compressor(self, encoding, level):
+        """
+        Creating an incremental compressor.
+
+        Args:
+            encoding: The content coding.
+            level: The compression level.
+
+        Returns:
+            A zlib compress object, or None for identity.
+        """
+
+        if encoding == 'identity':
+            return None
+
+        # gzip container format or zlib format
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        return zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+
+    def _compress_level(self, resp_hdr):
+        """
+        Getting the compression level for the content type of a response.
+
+        Args:
+            resp_hdr: The response header from web server.
+
+        Returns:
+            The configured level of the exact type, of its major type or of
+            '*', otherwise the default level.
+        """
+
+        content_type = self._parse_header(resp_hdr).get('content-type', '')
+        content_type = content_type.split(';', 1)[0].strip().lower()
+
+        for name in (content_type, content_type.split('/', 1)[0] + '/*', '*'):
+            if name in self.compress_levels:
+                return self.compress_levels[name]
+
+        return self.compress_level
+
+
+    def _has_body(self, resp_hdr):
+        """
+        Checking whether a response has content, 1xx, 204 and 304 responses
+        never have.
+
+        Args:
+            resp_hdr: The response header from web server.
+
+        Returns:
+            False for a bodiless status, otherwise True.
+        """
+
+        status = resp_hdr.split('\r\n', 1)[0].split(' ', 2)
+        if len(status) < 2 or not status[1].isdigit():
+            return True
+
+        status = int(status[1])
+        return not (status < 200 or status in (204, 304))
+
+
+    def _modify_header(self, resp_hdr, encoding, c_resp_cont_len=None):
+        """
+        Modifying the response header for the compressed content. The
+        header of a bodiless response is kept apart from the hop-by-hop
+        fields.
+
+        Args:
+            resp_hdr: The response header from web server.
+            encoding: The content coding.
+            c_resp_cont_len:
+                The compressed content length, if None the content length is
+                unknown and the Content-Length field is removed.
+
+        Returns:
+            The modified header, without the Connection field and the
+            terminating empty line.
+        """
+
+        lines = resp_hdr.split('\r\n')
+        new_resp_hdr = [lines[0]]
+
+        # Hop-by-hop fields are not forwarded
+        if not self._has_body(resp_hdr):
+            skipped = ('transfer-encoding', 'connection', 'keep-alive')
+            new_resp_hdr.extend(
+                item for item in lines[1:]
+                if item and item.split(':', 1)[0].strip().lower()
+                not in skipped)
+            return '\r\n'.join(new_resp_hdr + [''])
+
+        # The content is de-chunked and compressed
+        skipped = ('content-length', 'content-encoding', 'transfer-encoding',
+                   'connection', 'keep-alive', 'vary')
+        vary = ['Accept-Encoding']
+
+        for item in lines[1:]:
+            name = item.split(':', 1)[0].strip().lower()
+            if name == 'vary':
+                vary.insert(0, item.split(':', 1)[1].strip())
+            elif item and name not in skipped:
+                new_resp_hdr.append(item)
+
+        if encoding != 'identity':
+            new_resp_hdr.append('Content-Encoding: %s' % encoding)
+        new_resp_hdr.append('Vary: %s' % ', '.join(vary))
+        if c_resp_cont_len is not None:
+            new_resp_hdr.append('Content-Length: %d' % c_resp_cont_len)
+
+        return '\r\n'.join(new_resp_hdr + [''])
+
+
+    def _read_warmup_list(self):
+        """
+        Reading the warm-up targets. A line holding a quoted request line,
+        as access logs do, yields its target, any other line its first
+        word. Empty lines and lines starting with '#' are skipped.
+
+        Returns:
+            The list of targets, without duplicates.
+        """
+
+        targets = []
+
+        with open(self.warmup_file) as warmup_file:
+            for line in warmup_file:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                # Access log, e.g. '... "GET http://host/path HTTP/1.1" ...'
+                parts = line.split('"')
+                if len(parts) > 2 and len(parts[1].split(' ')) == 3:
+                    method, target, _ = parts[1].split(' ')
+                    if method != 'GET':
+                        continue
+                else:
+                    target = line.split()[0]
+
+                if target.startswith(('http://', 'https://')):
+                    targets.append(target)
+
+        if self.warmup_top is not None:
+            return [target for target, _ in
+                    Counter(targets).most_common(self.warmup_top)]
+
+        return list(OrderedDict.fromkeys(targets))
+
+
+    async def _warm_up(self):
+        """
+        Coroutine: Fetching the warm-up targets into the cache with a pool
+        of workers. Fetches are shared with concurrent clients, targets
+        already cached are skipped.
+        """
+
+        try:
+            targets = self._read_warmup_list()
+        except OSError as error:
+            sys.stderr.write('Warm-up list not readable: %s\n' % error)
+            return
+
+        queue = asyncio.Queue()
+        for target in targets:
+            queue.put_nowait(target)
+
+        async def worker():
+            while not queue.empty():
+                target = queue.get_nowait()
+                encoding = self.encodings[0]
+                key = self._calc_hash(target, encoding)
+
+                if self.mem_cached.get(key) is not None:
+                    self.metrics.inc('warmup_fetches_total', result='cached')
+                    continue
+
+                try:
+                    await self._get_shared_fetch(target, encoding, key)
+                except Exception:
+                    self.metrics.inc('warmup_fetches_total', result='error')
+                else:
+                    self.metrics.inc('warmup_fetches_total', result='ok')
+
+        await asyncio.gather(*[worker() for _ in
+                               range(min(self.warmup_workers, len(targets)))])
 
 
     def run(self):
         '''
         Overriding the run function in parent class.
-        The event loop begins from here.
+        The event loop begins from here, or from the workers.
         '''
 
-        # Generating asynchronous server object
-        self.event_loop.run_until_complete(self.server_coro)
+        if self.workers > 1:
+            self.run_workers(self.workers)
+        else:
+            self._serve()
+
+
+    def run_worker(self, idx):
+        '''
+        Overriding the run_worker function in parent class.
+        Each worker runs its own event loop, the one of master must not be
+        shared across processes.
+        '''
+
+        self.event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.event_loop)
+
+        self.mem_cached.event_loop = self.event_loop
+        self.conn_pool.event_loop = self.event_loop
+        self.dns_cache.event_loop = self.event_loop
+
+        # Own directory and share of the budget, left intact by the others
+        if self.disk_cache_dir is not None:
+            self.disk_cached = DiskCache(
+                os.path.join(self.disk_cache_dir, 'worker-%d' % idx),
+                max_bytes=self.disk_cache_size // self.workers,
+                ttl=self.cache_live, loop=self.event_loop)
+
+        self.compress_executor = self._new_compress_executor()
+
+        # Stopping on SIGTERM from master, so that the executor is shut down
+        self.event_loop.add_signal_handler(SIGTERM, self.event_loop.stop)
+
+        self._serve(idx)
+
+        if self.compress_executor is not None:
+            self.compress_executor.shutdown()
+
+
+    def _serve(self, idx=0):
+        '''
+        Serving on the event loop of this process.
+
+        Args:
+            idx: The worker index.
+        '''
+
+        # The memory cache is shared among workers, warming it up once
+        warm_up = self.warmup_file is not None and idx == 0
+        if warm_up and self.warmup_blocking:
+            self.event_loop.run_until_complete(self._warm_up())
+
+        # Generating asynchronous server object, workers share the port
+        server_coro = asyncio.start_server(self._req_handler,
+                                           self.host, self.port,
+                                           reuse_port=self.workers > 1)
+        self.event_loop.run_until_complete(server_coro)
+
+        # Metrics are only served locally
+        if self.stats_port is not None:
+            self.event_loop.run_until_complete(asyncio.start_server(
+                self.metrics.handle, '127.0.0.1', self.stats_port + idx))
+
+        if warm_up and not self.warmup_blocking:
+            self.event_loop.create_task(self._warm_up())
+
+        # Expired cache entries are swept in background
+        self.mem_cached.start_sweeper()
 
         # Main event loop begins to work
         self.event_loop.run_forever()
 
 
+def parse_args():
+    """
+    Parsing the command line arguments. Paths are made absolute, as the
+    daemon changes its working directory.
+
+    Returns:
+        The parsed arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='HTTP proxy server with '
+                                     'compression function.')
+    parser.add_argument('command', choices=('start', 'stop', 'restart'))
+    parser.add_argument('--port', type=int, default=8123,
+                        help='port to bind')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of pre-forked worker processes')
+    parser.add_argument('--stats-port', type=int,
+                        help='local port serving the metrics')
+    parser.add_argument('--cache-size', type=int, default=64 * 1024 * 1024,
+                        help='memory cache budget in bytes')
+    parser.add_argument('--cache-live', type=int, default=3600,
+                        help='default time to live of a cached response')
+    parser.add_argument('--disk-cache-dir', type=os.path.abspath,
+                        help='directory of the disk cache')
+    parser.add_argument('--disk-cache-size', type=int,
+                        default=1024 * 1024 * 1024,
+                        help='disk cache budget in bytes')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream missed responses')
+    parser.add_argument('--compress-executor', choices=('thread', 'process'),
+                        help='offload compression to a pool')
+    parser.add_argument('--warmup-file', type=os.path.abspath,
+                        help='targets to fetch into the cache at start')
+    parser.add_argument('--warmup-top', type=int,
+                        help='number of most frequent warm-up targets')
+
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
     # Checking python version
-    if sys.version_info < (3, 5, 0):
-        print('Must use Python 3.5.0 or later.')
+    if sys.version_info < (3, 7, 0):
+        print('Must use Python 3.7.0 or later.')
         exit(1)
 
 
-    # Entrance, creating server object
-    daemon = AsynCompressProxy()
+    # Parsing arguments
+    args = parse_args()
 
 
-    # Parsing arguments
-    if len(sys.argv) == 2:
-        if 'start' == sys.argv[1]:
-            daemon.start()
-        elif 'stop' == sys.argv[1]:
-            daemon.stop()
-        elif 'restart' == sys.argv[1]:
-            daemon.restart()
-        else:
-            print('Usage: %s [start|stop|restart]' % sys.argv[0])
-            sys.exit(1)
-    else:
-        print('Usage: %s [start|stop|restart]' % sys.argv[0])
-        sys.exit(1)
+    # Entrance, creating server object
+    daemon = AsynCompressProxy(port=args.port, workers=args.workers,
+                               stats_port=args.stats_port,
+                               cache_size=args.cache_size,
+                               cache_live=args.cache_live,
+                               disk_cache_dir=args.disk_cache_dir,
+                               disk_cache_size=args.disk_cache_size,
+                               stream_mode=args.stream,
+                               compress_executor=args.compress_executor,
+                               warmup_file=args.warmup_file,
+                               warmup_top=args.warmup_top)
+
+
+    if 'start' == args.command:
+        daemon.start()
+    elif 'stop' == args.command:
+        daemon.stop()
+    elif 'restart' == args.command:
+        daemon.restart()
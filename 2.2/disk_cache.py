@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 2
+# Task 2.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Persistent on-disk cache for the compression proxy. Every response is
+# stored in its own file named by the cache key, so that the cache survives
+# restarts and the content can be sent with sendfile.
+#
+
+import asyncio
+import os
+import struct
+import tempfile
+import time
+from stat import S_ISREG
+from collections import OrderedDict
+
+
+class DiskCache(object):
+    '''
+    Content-addressed file cache bounded by the total size of its files.
+
+    Each file consists of a prefix (expiry time, header length), the
+    response header and the compressed content.
+
+    Args:
+        cache_dir: The directory for storing the cache files.
+        max_bytes: The byte budget of all cache files.
+        ttl: The time to live of an entry, in seconds.
+        loop: The event loop, whose default executor writes the files.
+    '''
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024, ttl=3600,
+                 loop=None):
+        '''
+        Initialization.
+        '''
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.event_loop = loop or asyncio.get_event_loop()
+
+        # File prefix: expiry as wall clock time, header length
+        self.prefix = struct.Struct('>dI')
+
+        # Sizes of the cached files, the least recently used comes first
+        self.entries = OrderedDict()
+        self.cur_bytes = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+
+    def _load_index(self):
+        """
+        Building the index from the files left by previous runs, ordered by
+        modification time.
+        """
+
+        files = []
+
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+
+            # Removing half written files
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+
+            stat = os.stat(path)
+            # Subdirectories of the workers of a multi-process server
+            if not S_ISREG(stat.st_mode):
+                continue
+            files.append((stat.st_mtime, name, stat.st_size))
+
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.cur_bytes += size
+
+        self._evict()
+
+
+    def _path(self, key):
+        """
+        Getting the file path of a key.
+
+        Args:
+            key: The entry key, a hex digest.
+
+        Returns:
+            The file path.
+        """
+
+        return os.path.join(self.cache_dir, key)
+
+
+    async def get(self, key):
+        """
+        Coroutine: Looking up an entry, only the header is read into memory.
+        A miss is answered from the index, the file is opened in the
+        executor.
+
+        Args:
+            key: The entry key.
+
+        Returns:
+            A tuple (resp_hdr, cache_file, offset, count) locating the
+            compressed content in the opened file, which has to be closed by
+            the caller, or None if missing or expired.
+        """
+
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        resp = await self.event_loop.run_in_executor(
+            None, self._open_file, self._path(key))
+
+        if resp is None:
+            # The file is already removed
+            if key in self.entries:
+                self.cur_bytes -= self.entries.pop(key)
+            self.misses += 1
+            return None
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        self.hits += 1
+
+        return resp
+
+
+    def _open_file(self, path):
+        """
+        Opening a cache file and reading its header, executed in the
+        executor. Expired and broken files are removed.
+
+        Args:
+            path: The file path.
+
+        Returns:
+            The tuple (resp_hdr, cache_file, offset, count), or None.
+        """
+
+        # Keeping the file open, it may be replaced by a newer version
+        cache_file = None
+        try:
+            cache_file = open(path, 'rb')
+            expire, hdr_len = self.prefix.unpack(
+                cache_file.read(self.prefix.size))
+            resp_hdr = cache_file.read(hdr_len)
+            size = os.fstat(cache_file.fileno()).st_size
+        except (OSError, struct.error):
+            expire = 0
+
+        if expire < time.time():
+            if cache_file is not None:
+                cache_file.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        offset = self.prefix.size + hdr_len
+        return (resp_hdr, cache_file, offset, size - offset)
+
+
+    async def put(self, key, value, ttl=None):
+        """
+        Coroutine: Writing an entry, evicting the least recently used files
+        until the cache fits into its budget again.
+
+        Args:
+            key: The entry key.
+            value: The compressed response tuple (resp_hdr, resp_cont).
+            ttl: The time to live in seconds, the default one if None.
+        """
+
+        size = self.prefix.size + len(value[0]) + len(value[1])
+        if size > self.max_bytes:
+            return
+
+        expire = time.time() + (self.ttl if ttl is None else ttl)
+        prefix = self.prefix.pack(expire, len(value[0]))
+        written = await self.event_loop.run_in_executor(
+            None, self._write_file, self._path(key), (prefix,) + value)
+        if not written:
+            return
+
+        if key in self.entries:
+            self.cur_bytes -= self.entries.pop(key)
+        self.entries[key] = size
+        self.cur_bytes += size
+
+        self._evict()
+
+
+    def _write_file(self, path, parts):
+        """
+        Writing a cache file atomically, executed in the executor.
+
+        Args:
+            path: The file path.
+            parts: The bytes objects to be written.
+
+        Returns:
+            False if writing failed, e.g. the disk is full.
+        """
+
+        tmp_path = None
+
+        try:
+            # Unique name, concurrent writes of one key must not share it
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp',
+                                            dir=self.cache_dir)
+            with open(fd, 'wb') as cache_file:
+                for part in parts:
+                    cache_file.write(part)
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+        return True
+
+
+    def remove(self, key):
+        """
+        Removing an entry and its file if it exists.
+
+        Args:
+            key: The entry key.
+        """
+
+        if key not in self.entries:
+            return
+
+        self.cur_bytes -= self.entries.pop(key)
+
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        """
+        Removing the least recently used files while over budget.
+        """
+
+        while self.cur_bytes > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+
+    def stats(self):
+        """
+        Getting the cache counters.
+
+        Returns:
+            A dict of hit, miss and eviction counters, plus the current number
+            of entries and bytes.
+        """
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.cur_bytes}
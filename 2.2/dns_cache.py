@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 2
+# Task 2.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Cache of resolved web server addresses, so that getaddrinfo runs in the
+# executor once per host and TTL instead of once per connection.
+#
+
+import asyncio
+import socket
+import time
+
+
+class DNSCache(object):
+    '''
+    Cache of the addresses of host names, including failed lookups.
+    Concurrent lookups of one host share a single getaddrinfo call.
+
+    Args:
+        ttl: Seconds a resolved address list is kept.
+        negative_ttl: Seconds a failed lookup is kept.
+        max_entries: The maximum number of cached host names.
+        loop: The event loop running getaddrinfo in its executor.
+    '''
+
+    def __init__(self, ttl=300, negative_ttl=30, max_entries=4096,
+                 loop=None):
+        '''
+        Initialization.
+        '''
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.event_loop = loop or asyncio.get_event_loop()
+
+        # (host, port) to (expire, addresses or exception)
+        self.entries = dict()
+        # Lookups in flight
+        self.pending = dict()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+
+    async def resolve(self, host, port):
+        """
+        Coroutine: Getting the addresses of a host.
+
+        Args:
+            host: The host name.
+            port: The port.
+
+        Returns:
+            A list of (family, sockaddr) tuples, IPv6 and IPv4 interleaved.
+
+        Raises:
+            socket.gaierror: The host can't be resolved, possibly cached.
+        """
+
+        key = (host, port)
+        entry = self.entries.get(key)
+
+        if entry is not None and entry[0] >= time.monotonic():
+            self.hits += 1
+            if isinstance(entry[1], Exception):
+                # A new exception, the cached one would collect tracebacks
+                raise socket.gaierror(*entry[1].args)
+            return entry[1]
+
+        self.misses += 1
+
+        lookup = self.pending.get(key)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._lookup(host, port),
+                                           loop=self.event_loop)
+            self.pending[key] = lookup
+            lookup.add_done_callback(lambda _: self.pending.pop(key, None))
+            # All waiters may be gone, retrieving errors
+            lookup.add_done_callback(
+                lambda done: done.cancelled() or done.exception())
+
+        return await asyncio.shield(lookup)
+
+
+    async def _lookup(self, host, port):
+        """
+        Coroutine: Resolving a host and caching the result.
+
+        Args:
+            host: The host name.
+            port: The port.
+
+        Returns:
+            The address list.
+        """
+
+        if len(self.entries) >= self.max_entries:
+            self._purge()
+
+        try:
+            infos = await self.event_loop.getaddrinfo(
+                host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as error:
+            self.failures += 1
+            self.entries[(host, port)] = (
+                time.monotonic() + self.negative_ttl, error)
+            raise
+
+        addrs = self._interleave([(info[0], info[4]) for info in infos])
+        self.entries[(host, port)] = (time.monotonic() + self.ttl, addrs)
+
+        return addrs
+
+
+    def _interleave(self, addrs):
+        """
+        Alternating the address families, starting with the first one
+        returned, as happy eyeballs expects.
+
+        Args:
+            addrs: The list of (family, sockaddr) tuples.
+
+        Returns:
+            The reordered list, without duplicates.
+        """
+
+        unique = []
+        for addr in addrs:
+            if addr not in unique:
+                unique.append(addr)
+
+        if not unique:
+            return unique
+
+        first = [addr for addr in unique if addr[0] == unique[0][0]]
+        rest = [addr for addr in unique if addr[0] != unique[0][0]]
+
+        result = []
+        for idx in range(max(len(first), len(rest))):
+            result.extend(first[idx:idx + 1])
+            result.extend(rest[idx:idx + 1])
+
+        return result
+
+
+    def _purge(self):
+        """
+        Removing expired entries, or all of them if none is expired.
+        """
+
+        now = time.monotonic()
+        expired = [key for key, entry in self.entries.items()
+                   if entry[0] < now]
+
+        if not expired:
+            self.entries.clear()
+            return
+
+        for key in expired:
+            del self.entries[key]
+
+
+    def stats(self):
+        """
+        Getting the cache counters.
+
+        Returns:
+            A dict of hit, miss and failure counters, plus the current
+            number of entries.
+        """
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'failures': self.failures,
+                'entries': len(self.entries)}
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 2
+# Task 2.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Incremental HTTP/1.1 response parser working on bytes. Content pieces are
+# returned as memoryview slices of the fed data, without copying them.
+#
+
+
+class HTTPResponseParser(object):
+    '''
+    Incremental parser of one HTTP response, fed with the bytes received
+    from web server. Handles the status line, header fields, and content
+    delimited by Content-Length, chunked encoding or closing the connection.
+
+    Args:
+        max_header_size: The maximum size of the response header.
+    '''
+
+    def __init__(self, max_header_size=65536):
+        '''
+        Initialization.
+        '''
+
+        # Parsing states
+        self.STATE_HEADER     = 0
+        self.STATE_LENGTH     = 1
+        self.STATE_CHUNK_SIZE = 2
+        self.STATE_CHUNK_DATA = 3
+        self.STATE_CHUNK_END  = 4
+        self.STATE_TRAILER    = 5
+        self.STATE_UNTIL_EOF  = 6
+        self.STATE_DONE       = 7
+
+        self.state = self.STATE_HEADER
+        self.max_header_size = max_header_size
+
+        # Unfinished header or control line
+        self.buf = bytearray()
+        # Remaining bytes of the content or of the current chunk
+        self.remaining = 0
+
+        # Parsed header
+        self.header = None
+        self.version = None
+        self.status = None
+        self.fields = None
+        self.keep_alive = False
+
+        # Number of bytes fed, and of bytes following the response
+        self.received = 0
+        self.extra = 0
+
+
+    @property
+    def done(self):
+        """
+        Whether the response is complete.
+        """
+
+        return self.state == self.STATE_DONE
+
+
+    def feed(self, data):
+        """
+        Parsing received bytes.
+
+        Args:
+            data: The bytes received from web server.
+
+        Returns:
+            A list of memoryview objects, the pieces of content contained in
+            data.
+        """
+
+        self.received += len(data)
+        chunks = []
+        view = memoryview(data)
+        pos = 0
+
+        while pos < len(view) and self.state != self.STATE_DONE:
+            if self.state == self.STATE_HEADER:
+                data, pos = self._parse_header(data, pos)
+                view = memoryview(data)
+
+            elif self.state in (self.STATE_LENGTH, self.STATE_CHUNK_DATA):
+                size = min(self.remaining, len(view) - pos)
+                chunks.append(view[pos:pos + size])
+                pos += size
+                self.remaining -= size
+
+                if self.remaining == 0:
+                    if self.state == self.STATE_LENGTH:
+                        self.state = self.STATE_DONE
+                    else:
+                        self.remaining = 2
+                        self.state = self.STATE_CHUNK_END
+
+            elif self.state == self.STATE_CHUNK_END:
+                # Skipping CRLF after chunk data
+                size = min(self.remaining, len(view) - pos)
+                pos += size
+                self.remaining -= size
+
+                if self.remaining == 0:
+                    self.state = self.STATE_CHUNK_SIZE
+
+            elif self.state == self.STATE_UNTIL_EOF:
+                chunks.append(view[pos:])
+                pos = len(view)
+
+            else:
+                line, data, pos = self._read_line(data, pos)
+                view = memoryview(data)
+                if line is None:
+                    break
+
+                if self.state == self.STATE_CHUNK_SIZE:
+                    self.remaining = int(line.split(b';', 1)[0], 16)
+                    self.state = self.STATE_CHUNK_DATA if self.remaining \
+                        else self.STATE_TRAILER
+                elif not line:
+                    # Empty line terminating the trailer fields
+                    self.state = self.STATE_DONE
+
+        self.extra += len(view) - pos
+
+        return chunks
+
+
+    def eof(self):
+        """
+        Telling the parser the connection has been closed by web server.
+
+        Raises:
+            ConnectionError: The response is incomplete.
+        """
+
+        if self.state == self.STATE_UNTIL_EOF:
+            self.state = self.STATE_DONE
+        elif self.state != self.STATE_DONE:
+            raise ConnectionError('Connection closed before the response '
+                                  'was complete.')
+
+
+    def _read_line(self, data, pos):
+        """
+        Reading a CRLF terminated control line, which may be split over
+        several received pieces.
+
+        Args:
+            data: The received bytes.
+            pos: The position to start from.
+
+        Returns:
+            A tuple (line, data, pos), where line is None if it isn't
+            complete yet, and data and pos describe the unparsed rest.
+        """
+
+        # Joining with the beginning of the line kept from the last piece
+        if self.buf:
+            data = bytes(self.buf) + data[pos:]
+            pos = 0
+            self.buf = bytearray()
+
+        end = data.find(b'\r\n', pos)
+        if end < 0:
+            self.buf += data[pos:]
+            return (None, data, len(data))
+
+        return (data[pos:end], data, end + 2)
+
+
+    def _parse_header(self, data, pos):
+        """
+        Collecting and parsing the response header, choosing the content
+        framing afterwards.
+
+        Args:
+            data: The received bytes.
+            pos: The position to start from.
+
+        Returns:
+            A tuple (data, pos) describing the unparsed rest.
+        """
+
+        # Searching only from the part not searched before
+        start = max(0, len(self.buf) - 3)
+        self.buf += data[pos:]
+        end = self.buf.find(b'\r\n\r\n', start)
+
+        if end < 0:
+            if len(self.buf) > self.max_header_size:
+                raise ValueError('Response header too large.')
+            return (b'', 0)
+
+        self.header = bytes(self.buf[:end + 4])
+        data = bytes(self.buf[end + 4:])
+        self.buf = bytearray()
+
+        lines = self.header.decode('latin-1').split('\r\n')
+        status_line = lines[0].split(' ', 2)
+        self.version = status_line[0]
+        self.status = int(status_line[1])
+
+        self.fields = dict()
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                self.fields[name.strip().lower()] = value.strip()
+
+        connection = self.fields.get('connection', '').lower()
+        self.keep_alive = 'keep-alive' in connection \
+            if self.version == 'HTTP/1.0' else 'close' not in connection
+
+        # Choosing the content framing
+        if self.status < 200 or self.status in (204, 304):
+            self.state = self.STATE_DONE
+        elif 'chunked' in self.fields.get('transfer-encoding', '').lower():
+            self.state = self.STATE_CHUNK_SIZE
+        elif 'content-length' in self.fields:
+            self.remaining = int(self.fields['content-length'])
+            self.state = self.STATE_LENGTH if self.remaining \
+                else self.STATE_DONE
+        else:
+            self.state = self.STATE_UNTIL_EOF
+            self.keep_alive = False
+
+        return (data, 0)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 2
+# Task 2.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Used to load test the proxy server offline. A local fake web server with
+# configurable content size and latency is requested through the proxy by
+# many concurrent keep-alive clients, all in this process.
+# Usage: sudo python3 load_test.py [-h] [options]
+#
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import time
+
+from cproxyd import AsynCompressProxy
+
+
+class FakeOrigin(object):
+    '''
+    Local stand-in for web servers, answering every request with a
+    repetitive text content after a delay.
+
+    Args:
+        body_size: The content size in bytes.
+        latency: Seconds before answering a request.
+    '''
+
+    def __init__(self, body_size, latency):
+        '''
+        Initialization.
+        '''
+
+        self.latency = latency
+        self.requests = 0
+
+        # Compressible like a web page, but not trivially
+        words = [b'proxy', b'cache', b'gzip', b'content', b'header', b'<p>']
+        rand = random.Random(0)
+        body = b' '.join(rand.choice(words) for _ in range(body_size // 4))
+        self.body = body[:body_size]
+
+
+    async def handle(self, reader, writer):
+        """
+        Coroutine: Answering the requests of a keep-alive connection.
+
+        Args:
+            reader: StreamReader object of the proxy connection.
+            writer: StreamWriter object of the proxy connection.
+        """
+
+        try:
+            while True:
+                await reader.readuntil(b'\r\n\r\n')
+                self.requests += 1
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                writer.write(b'HTTP/1.1 200 OK\r\n'
+                             b'Content-Type: text/html\r\n'
+                             b'Cache-Control: max-age=3600\r\n'
+                             b'Content-Length: %d\r\n\r\n' % len(self.body))
+                writer.write(self.body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def read_response(reader):
+    """
+    Coroutine: Reading one response of the proxy.
+
+    Args:
+        reader: StreamReader object of the client.
+
+    Returns:
+        The number of content bytes.
+    """
+
+    header = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+    fields = dict()
+    for line in header.split('\r\n')[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            fields[name.strip().lower()] = value.strip()
+
+    if 'content-length' in fields:
+        await reader.readexactly(int(fields['content-length']))
+        return int(fields['content-length'])
+
+    # Streamed responses are chunked
+    size = 0
+    while True:
+        chunk_size = int((await reader.readline()).split(b';')[0], 16)
+        if not chunk_size:
+            await reader.readline()
+            return size
+        await reader.readexactly(chunk_size + 2)
+        size += chunk_size
+
+
+async def client(proxy_port, targets, count, latencies):
+    """
+    Coroutine: Requesting random targets over one keep-alive connection.
+
+    Args:
+        proxy_port: The port of the proxy.
+        targets: The target addresses.
+        count: The number of requests.
+        latencies: The list collecting the latency of every request.
+    """
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', proxy_port)
+
+    try:
+        for _ in range(count):
+            target = random.choice(targets)
+            start = time.monotonic()
+            writer.write(('GET %s HTTP/1.1\r\nHost: load-test\r\n'
+                          'Accept-Encoding: gzip\r\n\r\n'
+                          % target).encode('ascii'))
+            await read_response(reader)
+            latencies.append(time.monotonic() - start)
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    """
+    Getting a percentile of sorted values.
+
+    Args:
+        values: The sorted values.
+        fraction: The percentile as fraction, from 0 to 1.
+
+    Returns:
+        The value.
+    """
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def rss_kib():
+    """
+    Getting the resident set size of this process.
+
+    Returns:
+        The size in KiB.
+    """
+
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+
+    return pages * resource.getpagesize() // 1024
+
+
+async def run_load(proxy, args):
+    """
+    Coroutine: Running the load test and printing the report.
+
+    Args:
+        proxy: The AsynCompressProxy object.
+        args: The parsed arguments.
+    """
+
+    origin = FakeOrigin(args.body_size, args.latency)
+    origin_server = await asyncio.start_server(origin.handle, '127.0.0.1', 0)
+    origin_port = origin_server.sockets[0].getsockname()[1]
+
+    proxy_server = await asyncio.start_server(proxy._req_handler,
+                                              '127.0.0.1', 0)
+    proxy_port = proxy_server.sockets[0].getsockname()[1]
+
+    targets = ['http://127.0.0.1:%d/page/%d' % (origin_port, idx)
+               for idx in range(args.urls)]
+
+    # Spreading the requests over the clients
+    counts = [args.requests // args.clients] * args.clients
+    for idx in range(args.requests % args.clients):
+        counts[idx] += 1
+
+    latencies = []
+    rss_before = rss_kib()
+    start = time.monotonic()
+
+    await asyncio.gather(*[client(proxy_port, targets, count, latencies)
+                           for count in counts if count])
+
+    elapsed = time.monotonic() - start
+    rss_after = rss_kib()
+
+    proxy_server.close()
+    origin_server.close()
+
+    latencies.sort()
+    stats = proxy.mem_cached.stats()
+    lookups = stats['hits'] + stats['misses']
+
+    print('Requests:          %d in %.2f s' % (len(latencies), elapsed))
+    print('Throughput:        %.1f req/s' % (len(latencies) / elapsed))
+    print('Latency p50:       %.2f ms' % (percentile(latencies, 0.5) * 1e3))
+    print('Latency p99:       %.2f ms' % (percentile(latencies, 0.99) * 1e3))
+    print('Latency max:       %.2f ms' % (latencies[-1] * 1e3))
+    print('Cache hit ratio:   %.3f' % (stats['hits'] / lookups
+                                       if lookups else 0.0))
+    print('Origin requests:   %d' % origin.requests)
+    print('Cache bytes:       %d' % stats['bytes'])
+    print('RSS growth:        %d KiB (%d -> %d)'
+          % (rss_after - rss_before, rss_before, rss_after))
+
+
+def parse_args():
+    """
+    Parsing the command line arguments.
+
+    Returns:
+        The parsed arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Load test of the proxy '
+                                     'with a local fake web server.')
+    parser.add_argument('--clients', type=int, default=50,
+                        help='concurrent client connections')
+    parser.add_argument('--requests', type=int, default=5000,
+                        help='total number of requests')
+    parser.add_argument('--urls', type=int, default=100,
+                        help='number of distinct targets')
+    parser.add_argument('--body-size', type=int, default=64 * 1024,
+                        help='content size of the fake web server in bytes')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='latency of the fake web server in seconds')
+    parser.add_argument('--cache-size', type=int, default=64 * 1024 * 1024,
+                        help='memory cache budget of the proxy in bytes')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream missed responses')
+    parser.add_argument('--compress-executor', choices=('thread', 'process'),
+                        help='offload compression to a pool')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    proxy = AsynCompressProxy(cache_size=args.cache_size,
+                              stream_mode=args.stream,
+                              compress_executor=args.compress_executor)
+
+    print('Proxy PID %d, %d clients, %d requests over %d targets of %d bytes'
+          % (os.getpid(), args.clients, args.requests, args.urls,
+             args.body_size))
+
+    proxy.event_loop.run_until_complete(run_load(proxy, args))
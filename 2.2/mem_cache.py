@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 2
+# Task 2.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Bounded in-memory cache for the compression proxy, with LRU eviction,
+# a total-bytes budget and background TTL sweeping.
+#
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class CacheEntry(object):
+    '''
+    Compact record of one cached response.
+
+    Args:
+        key: The entry key.
+        expire: The monotonic expiry time.
+        value: The response tuple (resp_hdr, resp_cont), returned by hits
+               as it is.
+        size: The accounted size in bytes.
+        validators: A dict of the ETag and Last-Modified fields, or None.
+        revalidate: Whether the entry must not be served once expired.
+    '''
+
+    __slots__ = ('key', 'expire', 'value', 'size', 'validators',
+                 'revalidate')
+
+    def __init__(self, key, expire, value, size, validators=None,
+                 revalidate=False):
+        '''
+        Initialization.
+        '''
+
+        self.key = key
+        self.expire = expire
+        self.value = value
+        self.size = size
+        self.validators = validators
+        self.revalidate = revalidate
+
+
+class MemCache(object):
+    '''
+    In-memory LRU cache bounded by the total size of the stored values.
+
+    Args:
+        max_bytes: The byte budget of all cached entries.
+        ttl: The time to live of an entry, in seconds.
+        sweep_interval: Seconds between two background sweeps of expired
+                        entries.
+        stale_keep: Seconds an expired entry with validators is kept for
+                    revalidation.
+        stale_serve: Seconds any expired entry is kept for being served
+                     while it is refreshed.
+        loop: The event loop driving the background sweeping.
+    '''
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600,
+                 sweep_interval=60, stale_keep=3600, stale_serve=0,
+                 loop=None):
+        '''
+        Initialization.
+        '''
+
+        # Cache budget and entry life
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_keep = stale_keep
+        self.stale_serve = stale_serve
+
+        # Entries are kept in LRU order, the least recently used comes first
+        self.entries = OrderedDict()
+        self.cur_bytes = 0
+
+        # Background sweeping
+        self.event_loop = loop or asyncio.get_event_loop()
+        self.sweep_interval = sweep_interval
+        self.sweep_handle = None
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def get(self, key):
+        """
+        Getting a cached value, and marking it as recently used.
+
+        Args:
+            key: The entry key.
+
+        Returns:
+            The cached value, or None if missing or expired.
+        """
+
+        entry = self.entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        now = time.monotonic()
+        if entry.expire < now:
+            if self._drop_time(entry) < now:
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+
+    def get_stale(self, key):
+        """
+        Getting an entry regardless of its expiry, for revalidating it.
+
+        Args:
+            key: The entry key.
+
+        Returns:
+            A tuple (value, validators, staleness, revalidate), where
+            staleness is the number of seconds since expiry, and revalidate
+            tells whether the value must not be served before revalidation,
+            or None if missing.
+        """
+
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        return (entry.value, entry.validators,
+                time.monotonic() - entry.expire, entry.revalidate)
+
+
+    def peek(self, key):
+        """
+        Getting the validators of an entry regardless of its expiry.
+
+        Args:
+            key: The entry key.
+
+        Returns:
+            A tuple (validators, staleness, revalidate) like get_stale(), or
+            None if missing.
+        """
+
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        return (entry.validators, time.monotonic() - entry.expire,
+                entry.revalidate)
+
+
+    def refresh(self, key, ttl=None):
+        """
+        Renewing the expiry of a revalidated entry.
+
+        Args:
+            key: The entry key.
+            ttl: The new time to live in seconds, the default one if None.
+        """
+
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            entry.expire = time.monotonic() \
+                + (self.ttl if ttl is None else ttl)
+            self.entries.move_to_end(key)
+
+
+    def put(self, key, value, ttl=None, validators=None, revalidate=False):
+        """
+        Adding or replacing an entry, evicting the least recently used
+        entries until the cache fits into its budget again.
+
+        Args:
+            key: The entry key.
+            value: The tuple (resp_hdr, resp_cont) to be cached.
+            ttl: The time to live in seconds, the default one if None.
+            validators:
+                A dict of the ETag and Last-Modified fields, entries with
+                validators are kept after expiry for revalidation.
+            revalidate:
+                Whether the entry must be revalidated once expired, instead
+                of being served stale.
+        """
+
+        size = self._entry_size(key, value)
+
+        # An entry larger than the whole budget is never cached
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+
+        expire = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self.entries[key] = CacheEntry(key, expire, value, size, validators,
+                                       revalidate)
+        self.cur_bytes += size
+
+        while self.cur_bytes > self.max_bytes:
+            old_key = next(iter(self.entries))
+            self._remove(old_key)
+            self.evictions += 1
+
+
+    def remove(self, key):
+        """
+        Removing an entry if it exists.
+
+        Args:
+            key: The entry key.
+        """
+
+        if key in self.entries:
+            self._remove(key)
+
+
+    def _remove(self, key):
+        """
+        Removing an existing entry and releasing its size.
+
+        Args:
+            key: The entry key.
+        """
+
+        entry = self.entries.pop(key)
+        self.cur_bytes -= entry.size
+
+
+    def _drop_time(self, entry):
+        """
+        Getting the time after which an expired entry is removed.
+
+        Args:
+            entry: The cache entry.
+
+        Returns:
+            The monotonic time.
+        """
+
+        serve = 0 if entry.revalidate else self.stale_serve
+        if entry.validators:
+            return entry.expire + max(self.stale_keep, serve)
+        return entry.expire + serve
+
+
+    def _entry_size(self, key, value):
+        """
+        Calculating the accounted size of an entry.
+
+        Args:
+            key: The entry key.
+            value: The cached tuple (resp_hdr, resp_cont).
+
+        Returns:
+            The size in bytes.
+        """
+
+        return len(key) + len(value[0]) + len(value[1])
+
+
+    def start_sweeper(self):
+        """
+        Starting the periodical background sweeping of expired entries.
+        """
+
+        if self.sweep_handle is None:
+            self.sweep_handle = self.event_loop.call_later(
+                self.sweep_interval, self._sweep)
+
+
+    def stop_sweeper(self):
+        """
+        Stopping the background sweeping.
+        """
+
+        if self.sweep_handle is not None:
+            self.sweep_handle.cancel()
+            self.sweep_handle = None
+
+
+    def _sweep(self):
+        """
+        Removing all expired entries which are not kept for revalidation,
+        then re-scheduling itself.
+        """
+
+        now = time.monotonic()
+        expired = [key for key, entry in self.entries.items()
+                   if self._drop_time(entry) < now]
+
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+
+        self.sweep_handle = self.event_loop.call_later(
+            self.sweep_interval, self._sweep)
+
+
+    def stats(self):
+        """
+        Getting the cache counters.
+
+        Returns:
+            A dict of hit, miss, eviction and expiration counters, plus the
+            current number of entries and bytes.
+        """
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self.entries),
+                'bytes': self.cur_bytes}
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 2
+# Task 2.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Counters, gauges and histograms of the compression proxy, served in the
+# Prometheus text format on a local stats port.
+#
+
+import asyncio
+from collections import OrderedDict
+
+
+class Histogram(object):
+    '''
+    Cumulative histogram of observed values.
+
+    Args:
+        buckets: The upper bounds of the buckets, in ascending order.
+    '''
+
+    def __init__(self, buckets):
+        '''
+        Initialization.
+        '''
+
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value):
+        """
+        Adding an observed value.
+
+        Args:
+            value: The observed value.
+        """
+
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+                break
+
+        self.count += 1
+        self.sum += value
+
+
+    def samples(self):
+        """
+        Getting the samples of the histogram.
+
+        Returns:
+            A list of (suffix, le, value) tuples, where le is the bucket
+            bound, or None for the sum and count samples.
+        """
+
+        samples = []
+        cumulative = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append(('_bucket', '%g' % bound, cumulative))
+
+        samples.append(('_bucket', '+Inf', self.count))
+        samples.append(('_sum', None, self.sum))
+        samples.append(('_count', None, self.count))
+
+        return samples
+
+
+class Metrics(object):
+    '''
+    Registry of the proxy metrics. Every metric has a value per combination
+    of label values.
+
+    Args:
+        prefix: The prefix of all metric names.
+    '''
+
+    def __init__(self, prefix='cproxy'):
+        '''
+        Initialization.
+        '''
+
+        self.prefix = prefix
+
+        # Metric name to [type, help, values by labels, histogram buckets]
+        self.metrics = OrderedDict()
+
+        # Functions updating metrics from other objects before rendering
+        self.collectors = []
+
+
+    def counter(self, name, help_text):
+        """
+        Registering a counter.
+
+        Args:
+            name: The metric name, without prefix.
+            help_text: The description.
+        """
+
+        self.metrics[name] = ['counter', help_text, OrderedDict(), None]
+
+
+    def gauge(self, name, help_text):
+        """
+        Registering a gauge.
+
+        Args:
+            name: The metric name, without prefix.
+            help_text: The description.
+        """
+
+        self.metrics[name] = ['gauge', help_text, OrderedDict(), None]
+
+
+    def histogram(self, name, help_text, buckets):
+        """
+        Registering a histogram.
+
+        Args:
+            name: The metric name, without prefix.
+            help_text: The description.
+            buckets: The upper bounds of the buckets, in ascending order.
+        """
+
+        self.metrics[name] = ['histogram', help_text, OrderedDict(), buckets]
+
+
+    def add_collector(self, collector):
+        """
+        Adding a function called before rendering, for setting metrics
+        kept by other objects, such as the cache counters.
+
+        Args:
+            collector: The function, called with this registry.
+        """
+
+        self.collectors.append(collector)
+
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Increasing a counter or a gauge.
+
+        Args:
+            name: The metric name.
+            amount: The increment, may be negative for gauges.
+            labels: The label values.
+        """
+
+        values = self.metrics[name][2]
+        key = tuple(sorted(labels.items()))
+        values[key] = values.get(key, 0) + amount
+
+
+    def set(self, name, value, **labels):
+        """
+        Setting a gauge, or a counter kept by another object.
+
+        Args:
+            name: The metric name.
+            value: The value.
+            labels: The label values.
+        """
+
+        self.metrics[name][2][tuple(sorted(labels.items()))] = value
+
+
+    def observe(self, name, value, **labels):
+        """
+        Adding an observed value to a histogram.
+
+        Args:
+            name: The metric name.
+            value: The observed value.
+            labels: The label values.
+        """
+
+        metric = self.metrics[name]
+        key = tuple(sorted(labels.items()))
+
+        histogram = metric[2].get(key)
+        if histogram is None:
+            histogram = metric[2][key] = Histogram(metric[3])
+        histogram.observe(value)
+
+
+    def render(self):
+        """
+        Rendering all metrics in the Prometheus text format.
+
+        Returns:
+            The text in bytes.
+        """
+
+        for collector in self.collectors:
+            collector(self)
+
+        lines = []
+
+        for name, (kind, help_text, values, _) in self.metrics.items():
+            full_name = '%s_%s' % (self.prefix, name)
+            lines.append('# HELP %s %s' % (full_name, help_text))
+            lines.append('# TYPE %s %s' % (full_name, kind))
+
+            for key, value in values.items():
+                if kind != 'histogram':
+                    lines.append('%s%s %s' % (full_name,
+                                              self._labels(key), value))
+                    continue
+
+                for suffix, bound, sample in value.samples():
+                    sample_key = key if bound is None \
+                        else key + (('le', bound),)
+                    lines.append('%s%s%s %s' % (full_name, suffix,
+                                                self._labels(sample_key),
+                                                sample))
+
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+    def _labels(self, key):
+        """
+        Formatting the label values of a sample.
+
+        Args:
+            key: The tuple of (name, value) pairs.
+
+        Returns:
+            The label string, empty if there are no labels.
+        """
+
+        if not key:
+            return ''
+
+        return '{%s}' % ','.join('%s="%s"' % (name, value)
+                                 for name, value in key)
+
+
+    async def handle(self, reader, writer):
+        """
+        Coroutine: Answering a request on the stats port with the rendered
+        metrics, regardless of the requested path.
+
+        Args:
+            reader: StreamReader object of the client.
+            writer: StreamWriter object of the client.
+        """
+
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+
+            body = self.render()
+            writer.write(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: %d\r\n'
+                         b'Connection: close\r\n\r\n' % len(body))
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 2
+# Task 2.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Memory cache shared by the pre-forked proxy workers, living in one
+# anonymous shared mmap segment: a hash index of fixed size slots, and a
+# ring slab holding the cached responses.
+#
+
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+
+
+class SharedMemCache(object):
+    '''
+    Memory cache with the interface of MemCache, whose entries are visible
+    to all processes forked after its creation.
+
+    Responses are appended to the ring slab, wrapping around to its
+    beginning and overwriting the oldest ones, so the slab is always full
+    of the most recently stored responses and needs no sweeping. An index
+    slot whose content has been overwritten is dead.
+
+    The lock shared by the processes is taken with a timeout, which is
+    treated as a miss. A lock left by a dead process is released by the
+    next process timing out on it.
+
+    Args:
+        max_bytes: The size of the ring slab.
+        ttl: The time to live of an entry, in seconds.
+        stale_keep: Seconds an expired entry with validators is kept for
+                    revalidation.
+        stale_serve: Seconds any expired entry is kept for being served
+                     while it is refreshed.
+        slots: The number of index slots, by default one for each 16 KiB of
+               the slab.
+        lock_timeout: Seconds waited for the lock before giving up.
+        loop: Unused, for the interface of MemCache.
+    '''
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600, stale_keep=3600,
+                 stale_serve=0, slots=None, lock_timeout=0.1, loop=None):
+        '''
+        Initialization.
+        '''
+
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_keep = stale_keep
+        self.stale_serve = stale_serve
+        self.slots = slots or max(1024, max_bytes // 16384)
+        self.lock_timeout = lock_timeout
+        self.event_loop = loop
+
+        # Number of slots probed from the home slot of a key
+        self.probes = 8
+
+        # Segment header: absolute write position of the ring, PID of the
+        # lock holder
+        self.seg_hdr = struct.Struct('>Q')
+        self.holder = struct.Struct('>i')
+        self.holder_base = self.seg_hdr.size
+        # Index slot: key, content position, header, content and validators
+        # length, monotonic expiry, must be revalidated
+        self.key_size = 48
+        self.slot = struct.Struct('>%dsQIIId?' % self.key_size)
+
+        self.index_base = self.holder_base + self.holder.size
+        self.ring_base = self.index_base + self.slots * self.slot.size
+
+        # Anonymous mappings are shared with the children after fork
+        self.seg = mmap.mmap(-1, self.ring_base + self.max_bytes)
+        self.lock = multiprocessing.Lock()
+        # Only one process releases the lock of a dead holder
+        self.recovery_lock = multiprocessing.Lock()
+
+        # Counters of this process
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock_timeouts = 0
+
+
+    def get(self, key):
+        """
+        Getting a cached value.
+
+        Args:
+            key: The entry key.
+
+        Returns:
+            The cached value, or None if missing or expired.
+        """
+
+        if not self._acquire():
+            self.misses += 1
+            return None
+
+        try:
+            found = self._lookup(key)
+            if found is None or found[1][5] < time.monotonic():
+                self.misses += 1
+                return None
+            value = self._read_value(found[1])
+        finally:
+            self._release()
+
+        self.hits += 1
+        return value[:2]
+
+
+    def get_stale(self, key):
+        """
+        Getting an entry regardless of its expiry, for revalidating it.
+
+        Args:
+            key: The entry key.
+
+        Returns:
+            A tuple (value, validators, staleness, revalidate), where
+            staleness is the number of seconds since expiry, and revalidate
+            tells whether the value must not be served before revalidation,
+            or None if missing.
+        """
+
+        if not self._acquire():
+            return None
+
+        try:
+            found = self._lookup(key)
+            if found is None:
+                return None
+            value = self._read_value(found[1])
+        finally:
+            self._release()
+
+        staleness = time.monotonic() - found[1][5]
+        if not self._is_kept(found[1], value[2], staleness):
+            return None
+
+        return (value[:2], value[2], staleness, found[1][6])
+
+
+    def peek(self, key):
+        """
+        Getting the validators of an entry regardless of its expiry, without
+        copying the response out of the segment.
+
+        Args:
+            key: The entry key.
+
+        Returns:
+            A tuple (validators, staleness, revalidate) like get_stale(), or
+            None if missing.
+        """
+
+        if not self._acquire():
+            return None
+
+        try:
+            found = self._lookup(key)
+            if found is None:
+                return None
+            fields = found[1]
+            start = self.ring_base + fields[1] % self.max_bytes \
+                + fields[2] + fields[3]
+            validators = self._unpack_validators(
+                self.seg[start:start + fields[4]])
+        finally:
+            self._release()
+
+        staleness = time.monotonic() - fields[5]
+        if not self._is_kept(fields, validators, staleness):
+            return None
+
+        return (validators, staleness, fields[6])
+
+
+    def _is_kept(self, fields, validators, staleness):
+        """
+        Checking whether an expired entry is still kept. Dropped like in
+        MemCache, it is only kept for revalidation or serving.
+
+        Args:
+            fields: The slot fields.
+            validators: The validators of the entry.
+            staleness: The number of seconds since expiry.
+
+        Returns:
+            True if the entry is kept.
+        """
+
+        keep = 0 if fields[6] else self.stale_serve
+        if validators:
+            keep = max(self.stale_keep, self.stale_serve)
+
+        return staleness <= keep
+
+
+    def refresh(self, key, ttl=None):
+        """
+        Renewing the expiry of a revalidated entry.
+
+        Args:
+            key: The entry key.
+            ttl: The new time to live in seconds, the default one if None.
+        """
+
+        if not self._acquire():
+            return
+
+        try:
+            found = self._lookup(key)
+            if found is not None:
+                expire = time.monotonic() + (self.ttl if ttl is None else ttl)
+                self._write_slot(found[0],
+                                 found[1][:5] + (expire,) + found[1][6:])
+        finally:
+            self._release()
+
+
+    def put(self, key, value, ttl=None, validators=None, revalidate=False):
+        """
+        Appending an entry to the ring slab and pointing its index slot to
+        it.
+
+        Args:
+            key: The entry key.
+            value: The tuple (resp_hdr, resp_cont).
+            ttl: The time to live in seconds, the default one if None.
+            validators: A dict of the ETag and Last-Modified fields.
+            revalidate:
+                Whether the entry must be revalidated once expired, instead
+                of being served stale.
+        """
+
+        key_bytes = key.encode('ascii')
+        val_bytes = self._pack_validators(validators)
+        size = len(value[0]) + len(value[1]) + len(val_bytes)
+
+        # A response larger than the slab is never cached
+        if size > self.max_bytes or len(key_bytes) > self.key_size:
+            return
+
+        expire = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        if not self._acquire():
+            return
+
+        try:
+            write_pos = self.seg_hdr.unpack_from(self.seg, 0)[0]
+
+            # Responses never wrap around the end of the slab
+            offset = write_pos % self.max_bytes
+            if offset + size > self.max_bytes:
+                write_pos += self.max_bytes - offset
+                offset = 0
+
+            start = self.ring_base + offset
+            for part in (value[0], value[1], val_bytes):
+                self.seg[start:start + len(part)] = part
+                start += len(part)
+
+            self.seg_hdr.pack_into(self.seg, 0, write_pos + size)
+
+            idx = self._choose_slot(key_bytes)
+            self._write_slot(idx, (key_bytes, write_pos, len(value[0]),
+                                   len(value[1]), len(val_bytes), expire,
+                                   revalidate))
+        finally:
+            self._release()
+
+
+    def remove(self, key):
+        """
+        Removing an entry if it exists.
+
+        Args:
+            key: The entry key.
+        """
+
+        if not self._acquire():
+            return
+
+        try:
+            found = self._lookup(key)
+            if found is not None:
+                self._write_slot(found[0], (b'', 0, 0, 0, 0, 0.0, False))
+        finally:
+            self._release()
+
+
+    def _acquire(self):
+        """
+        Taking the lock, giving up after the lock timeout. If the holder has
+        died meanwhile, the lock is released for the next attempt.
+
+        Returns:
+            True if the lock is held.
+        """
+
+        if self.lock.acquire(timeout=self.lock_timeout):
+            self.holder.pack_into(self.seg, self.holder_base, os.getpid())
+            return True
+
+        self.lock_timeouts += 1
+
+        if not self.recovery_lock.acquire(block=False):
+            return False
+
+        try:
+            pid = self.holder.unpack_from(self.seg, self.holder_base)[0]
+            if pid and not self._is_running(pid):
+                self.holder.pack_into(self.seg, self.holder_base, 0)
+                self.lock.release()
+        finally:
+            self.recovery_lock.release()
+
+        return False
+
+
+    def _release(self):
+        """
+        Releasing the lock.
+        """
+
+        self.holder.pack_into(self.seg, self.holder_base, 0)
+        self.lock.release()
+
+
+    def _is_running(self, pid):
+        """
+        Checking whether a process exists.
+
+        Args:
+            pid: The process ID.
+
+        Returns:
+            False if the process has died.
+        """
+
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass
+
+        return True
+
+
+    def _home_slots(self, key_bytes):
+        """
+        Getting the slots probed for a key.
+
+        Args:
+            key_bytes: The encoded entry key, starting with a hex digest.
+
+        Returns:
+            The slot indexes.
+        """
+
+        home = int(key_bytes[:16], 16) % self.slots
+        return [(home + i) % self.slots for i in range(self.probes)]
+
+
+    def _read_slot(self, idx):
+        """
+        Reading an index slot.
+
+        Args:
+            idx: The slot index.
+
+        Returns:
+            The tuple (key, pos, hdr_len, cont_len, val_len, expire,
+            revalidate).
+        """
+
+        fields = self.slot.unpack_from(self.seg,
+                                       self.index_base + idx * self.slot.size)
+        return (fields[0].rstrip(b'\0'),) + fields[1:]
+
+
+    def _write_slot(self, idx, fields):
+        """
+        Writing an index slot.
+
+        Args:
+            idx: The slot index.
+            fields: The tuple (key, pos, hdr_len, cont_len, val_len,
+                    expire, revalidate).
+        """
+
+        self.slot.pack_into(self.seg, self.index_base + idx * self.slot.size,
+                            *fields)
+
+
+    def _is_alive(self, fields):
+        """
+        Checking whether the content of a slot is still in the ring slab.
+
+        Args:
+            fields: The slot fields.
+
+        Returns:
+            True if the content hasn't been overwritten.
+        """
+
+        write_pos = self.seg_hdr.unpack_from(self.seg, 0)[0]
+        size = fields[2] + fields[3] + fields[4]
+
+        return bool(fields[0]) and write_pos - fields[1] <= self.max_bytes \
+            and fields[1] + size <= write_pos
+
+
+    def _lookup(self, key):
+        """
+        Finding the live slot of a key, the lock must be held.
+
+        Args:
+            key: The entry key.
+
+        Returns:
+            A tuple (idx, fields), or None if missing.
+        """
+
+        key_bytes = key.encode('ascii')
+
+        for idx in self._home_slots(key_bytes):
+            fields = self._read_slot(idx)
+            if fields[0] == key_bytes:
+                if self._is_alive(fields):
+                    return (idx, fields)
+                return None
+
+        return None
+
+
+    def _choose_slot(self, key_bytes):
+        """
+        Choosing the slot for storing a key: its current one, a free or dead
+        one, or else the one with the oldest content.
+
+        Args:
+            key_bytes: The encoded entry key.
+
+        Returns:
+            The slot index.
+        """
+
+        oldest = None
+
+        for idx in self._home_slots(key_bytes):
+            fields = self._read_slot(idx)
+            if fields[0] == key_bytes or not self._is_alive(fields):
+                return idx
+            if oldest is None or fields[1] < oldest[1]:
+                oldest = (idx, fields[1])
+
+        self.evictions += 1
+        return oldest[0]
+
+
+    def _read_value(self, fields):
+        """
+        Copying the response and validators of a live slot out of the
+        segment, since other workers may overwrite it afterwards.
+
+        Args:
+            fields: The slot fields.
+
+        Returns:
+            A tuple (resp_hdr, resp_cont, validators).
+        """
+
+        start = self.ring_base + fields[1] % self.max_bytes
+        hdr_end = start + fields[2]
+        cont_end = hdr_end + fields[3]
+
+        return (self.seg[start:hdr_end], self.seg[hdr_end:cont_end],
+                self._unpack_validators(
+                    self.seg[cont_end:cont_end + fields[4]]))
+
+
+    def _pack_validators(self, validators):
+        """
+        Encoding the validators as header lines.
+
+        Args:
+            validators: A dict of the ETag and Last-Modified fields, or None.
+
+        Returns:
+            The encoded bytes.
+        """
+
+        if not validators:
+            return b''
+
+        return ''.join('%s: %s\r\n' % item
+                       for item in validators.items()).encode('latin-1')
+
+
+    def _unpack_validators(self, data):
+        """
+        Decoding the validators from header lines.
+
+        Args:
+            data: The encoded bytes.
+
+        Returns:
+            A dict of the ETag and Last-Modified fields, or None.
+        """
+
+        if not data:
+            return None
+
+        validators = dict()
+        for line in data.decode('latin-1').split('\r\n'):
+            name, sep, value = line.partition(': ')
+            if sep:
+                validators[name] = value
+
+        return validators
+
+
+    def start_sweeper(self):
+        """
+        Nothing to sweep, the ring slab overwrites the oldest entries.
+        """
+
+
+    def stop_sweeper(self):
+        """
+        Nothing to sweep, the ring slab overwrites the oldest entries.
+        """
+
+
+    def stats(self):
+        """
+        Getting the cache counters.
+
+        Returns:
+            A dict of hit, miss, eviction and lock timeout counters of this
+            process, plus
+            the current number of live entries and their bytes in the whole
+            segment.
+        """
+
+        entries = 0
+        cur_bytes = 0
+
+        if self._acquire():
+            try:
+                for idx in range(self.slots):
+                    fields = self._read_slot(idx)
+                    if self._is_alive(fields):
+                        entries += 1
+                        cur_bytes += fields[2] + fields[3] + fields[4]
+            finally:
+                self._release()
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'lock_timeouts': self.lock_timeouts,
+                'entries': entries,
+                'bytes': cur_bytes}
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 3
+# Task 3.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Pool of registered sensor clients, expiring silent clients in background
+#
+
+# Asynchronous IO support
+import asyncio
+import time
+import heapq
+
+
+class ClientPool(object):
+    """
+    Registered clients with their liveness deadlines. A min-heap of
+    deadlines, driven by loop.call_later, removes the clients which haven't
+    been refreshed in time, so that the pool only holds live clients.
+    """
+
+    def __init__(self, timeout=20, loop=None):
+        """
+        Initialization.
+
+        Args:
+            timeout: Seconds a client stays alive without being refreshed.
+            loop: The event loop driving the expiry, the current one if
+                  None.
+        """
+
+        self.timeout = timeout
+        self.event_loop = loop
+
+        # Client address to [name, deadline, deadline of its heap item,
+        # payload]
+        self.clients = dict()
+
+        # Heap of (deadline, address), one live item per client. Refreshing
+        # only updates the client, the item is moved when it comes up.
+        self.deadlines = []
+        self.expiry_handle = None
+
+
+    def __contains__(self, addr):
+        """
+        Checking whether a client is registered.
+        """
+
+        return addr in self.clients
+
+
+    def __iter__(self):
+        """
+        Iterating over the addresses of the live clients.
+        """
+
+        return iter(self.clients)
+
+
+    def __len__(self):
+        """
+        Getting the number of live clients.
+        """
+
+        return len(self.clients)
+
+
+    def __str__(self):
+        """
+        Describing the clients by their names.
+        """
+
+        return str(dict((addr, client[0])
+                        for addr, client in self.clients.items()))
+
+
+    def name(self, addr):
+        """
+        Getting the name of a client.
+
+        Args:
+            addr: The client address.
+
+        Returns:
+            The client name.
+        """
+
+        return self.clients[addr][0]
+
+
+    def payload(self, addr):
+        """
+        Getting the data prebuilt for a client at registration.
+
+        Args:
+            addr: The client address.
+
+        Returns:
+            The payload.
+        """
+
+        return self.clients[addr][3]
+
+
+    def register(self, addr, name, payload=None):
+        """
+        Registering a new client, or refreshing a registered one.
+
+        Args:
+            addr: The client address.
+            name: The client name.
+            payload: Data prebuilt for the client, kept as long as it is.
+        """
+
+        if addr in self.clients:
+            self.refresh(addr)
+            return
+
+        deadline = time.monotonic() + self.timeout
+        self.clients[addr] = [name, deadline, deadline, payload]
+        heapq.heappush(self.deadlines, (deadline, addr))
+
+        self._schedule()
+
+
+    def refresh(self, addr):
+        """
+        Extending the deadline of a client.
+
+        Args:
+            addr: The client address.
+        """
+
+        if addr in self.clients:
+            self.clients[addr][1] = time.monotonic() + self.timeout
+
+
+    def remove(self, addr):
+        """
+        Removing a client, its heap item is dropped when it comes up.
+
+        Args:
+            addr: The client address.
+        """
+
+        self.clients.pop(addr, None)
+
+
+    def _schedule(self):
+        """
+        Scheduling the expiry for the earliest deadline, if not scheduled.
+        """
+
+        if self.expiry_handle is not None or not self.deadlines:
+            return
+
+        if self.event_loop is None:
+            self.event_loop = asyncio.get_event_loop()
+
+        delay = max(0, self.deadlines[0][0] - time.monotonic())
+        self.expiry_handle = self.event_loop.call_later(delay, self._expire)
+
+
+    def _expire(self):
+        """
+        Removing the clients whose deadline has passed, moving the heap
+        items of refreshed clients to their new deadline.
+        """
+
+        self.expiry_handle = None
+        now = time.monotonic()
+
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, addr = heapq.heappop(self.deadlines)
+            client = self.clients.get(addr)
+
+            # Item of a removed client, or of an earlier registration
+            if client is None or client[2] != deadline:
+                continue
+
+            if client[1] <= now:
+                del self.clients[addr]
+            else:
+                client[2] = client[1]
+                heapq.heappush(self.deadlines, (client[1], addr))
+
+        self._schedule()
+
+
+    def close(self):
+        """
+        Stopping the expiry.
+        """
+
+        if self.expiry_handle is not None:
+            self.expiry_handle.cancel()
+            self.expiry_handle = None
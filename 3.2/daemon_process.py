@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
 import os, sys, time
+import traceback
 # Cleaning job at exit
 import atexit
 # Signal for killing daemon
+import signal
 from signal import SIGTERM
 
 
@@ -28,6 +30,11 @@ class DaemonProcess(object):
         self.stderr = stderr
         self.pid_file = pid_file
 
+        # Pre-forked workers, mapping PID to worker index
+        self.worker_pids = dict()
+        self.worker_restart_delay = 1
+        self.stopping = False
+
         # Permission check
         if os.geteuid():
             raise PermissionError('Permission denied, please run in root mode.')
@@ -160,9 +167,86 @@ class DaemonProcess(object):
         self.start()
 
 
+    def run_workers(self, workers):
+        '''
+        Pre-forking worker processes, each of them calling run_worker().
+        The calling process becomes the master, restarting dead workers
+        until it receives SIGTERM, which is then passed to all workers.
+        '''
+
+        signal.signal(SIGTERM, self._stop_workers)
+
+        for idx in range(workers):
+            self._spawn_worker(idx)
+
+        while self.worker_pids:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            idx = self.worker_pids.pop(pid, None)
+            if idx is None or self.stopping:
+                continue
+
+            sys.stderr.write('Worker %d (PID %d) died with status %d, '
+                             'restarting.\n' % (idx, pid, status))
+            # Not spinning if the worker dies right after starting
+            time.sleep(self.worker_restart_delay)
+            if not self.stopping:
+                self._spawn_worker(idx)
+
+
+    def _spawn_worker(self, idx):
+        '''
+        Forking a worker process.
+        '''
+
+        pid = os.fork()
+
+        if pid > 0:
+            self.worker_pids[pid] = idx
+            return
+
+        # Worker never returns, also skipping the atexit handlers of master
+        exit_code = 0
+        try:
+            signal.signal(SIGTERM, signal.SIG_DFL)
+            self.worker_pids = dict()
+            self.run_worker(idx)
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+
+    def _stop_workers(self, signum, frame):
+        '''
+        SIGTERM handler of master, terminating all workers.
+        '''
+
+        self.stopping = True
+
+        for pid in list(self.worker_pids):
+            try:
+                os.kill(pid, SIGTERM)
+            except OSError:
+                pass
+
+
     def run(self):
         '''
         Need to be overrided when derived, the daemon process actually
         works here.
         '''
 
+
+    def run_worker(self, idx):
+        '''
+        Need to be overrided when using run_workers(), each worker process
+        works here.
+        '''
+
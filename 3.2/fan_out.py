@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 3
+# Task 3.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Fan-out engine sending broadcast datagrams in batches across loop
+# iterations
+#
+
+# Asynchronous IO support
+import asyncio
+import os
+import socket
+import time
+from collections import deque
+
+import logging
+
+
+class FanOut(object):
+    """
+    Sending one datagram to many peers. A broadcast is queued and sent in
+    batches, one batch per loop iteration, so that received datagrams are
+    still handled during large broadcasts.
+    """
+
+    def __init__(self, transport, batch_size=256, loop=None):
+        """
+        Initialization.
+
+        Args:
+            transport: The datagram transport of the server socket.
+            batch_size: The number of datagrams sent per loop iteration.
+            loop: The event loop pacing the batches, the current one if
+                  None.
+        """
+
+        self.transport = transport
+        self.batch_size = batch_size
+        self.event_loop = loop or asyncio.get_event_loop()
+
+        # Duplicate of the server socket for sending without the transport,
+        # the socket of the transport itself must not be used for sending
+        fileno = transport.get_extra_info('socket').fileno()
+        self.sock = socket.socket(fileno=os.dup(fileno))
+        self.sock.setblocking(False)
+
+        # Queued broadcasts: [data, peers, position, enqueue time]
+        self.jobs = deque()
+        self.send_handle = None
+
+        # Counters
+        self.broadcasts = 0
+        self.datagrams = 0
+        self.deferred = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+
+    def broadcast(self, data, peers):
+        """
+        Queueing a datagram for a list of peers.
+
+        Args:
+            data: The datagram.
+            peers: The list of peer addresses, not changed afterwards.
+        """
+
+        if not peers:
+            return
+
+        self.jobs.append([data, peers, 0, time.monotonic()])
+
+        if self.send_handle is None:
+            self.send_handle = self.event_loop.call_soon(self._send_batch)
+
+
+    def _send_batch(self):
+        """
+        Sending the next batch of queued datagrams, then yielding to the
+        event loop if there are more.
+        """
+
+        self.send_handle = None
+        budget = self.batch_size
+        sendto = self.sock.sendto
+
+        while self.jobs and budget:
+            job = self.jobs[0]
+            data, peers, pos = job[0], job[1], job[2]
+            end = min(len(peers), pos + budget)
+
+            for peer in peers[pos:end]:
+                try:
+                    sendto(data, peer)
+                except BlockingIOError:
+                    # Send buffer full, the transport buffers it meanwhile
+                    self.transport.sendto(data, peer)
+                    self.deferred += 1
+                except OSError:
+                    self.errors += 1
+
+            self.datagrams += end - pos
+            budget -= end - pos
+            job[2] = end
+
+            if end == len(peers):
+                self.jobs.popleft()
+                self._finished(job)
+
+        if self.jobs:
+            self.send_handle = self.event_loop.call_soon(self._send_batch)
+
+
+    def _finished(self, job):
+        """
+        Recording the latency of a completed broadcast.
+
+        Args:
+            job: The completed broadcast.
+        """
+
+        latency = time.monotonic() - job[3]
+
+        self.broadcasts += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+
+        logging.debug('Fan-out to %d peers done in %.3f ms.', len(job[1]),
+                      latency * 1000)
+
+
+    def stats(self):
+        """
+        Getting the fan-out counters.
+
+        Returns:
+            A dict of the completed broadcasts, sent, deferred and failed
+            datagrams, the mean and maximum broadcast latency in seconds,
+            and the number of queued broadcasts.
+        """
+
+        return {'broadcasts': self.broadcasts,
+                'datagrams': self.datagrams,
+                'deferred': self.deferred,
+                'errors': self.errors,
+                'latency_mean': self.latency_sum / self.broadcasts
+                                if self.broadcasts else 0.0,
+                'latency_max': self.latency_max,
+                'queued': len(self.jobs)}
+
+
+    def close(self):
+        """
+        Dropping the queued broadcasts and closing the socket duplicate.
+        """
+
+        if self.send_handle is not None:
+            self.send_handle.cancel()
+            self.send_handle = None
+
+        self.jobs.clear()
+        self.sock.close()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 3
+# Task 3.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Links between the shards of Sensor Network Server, forwarding broadcasts
+# to the clients registered in other worker processes
+#
+
+# Asynchronous IO support
+import asyncio
+import socket
+
+
+class ShardLink(object):
+    """
+    Datagram links between shards. Every shard owns the receiving end of a
+    Unix datagram socket pair, and all of them share the sending ends, so
+    that a shard reaches each other shard with one send. Created before
+    forking, so that all workers inherit the sockets.
+    """
+
+    def __init__(self, shards):
+        """
+        Initialization.
+
+        Args:
+            shards: The number of shards.
+        """
+
+        # (receiving end, sending end) of each shard
+        self.pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+                      for _ in range(shards)]
+        for pair in self.pairs:
+            for sock in pair:
+                sock.setblocking(False)
+
+        self.idx = None
+        self.event_loop = None
+        self.on_forward = None
+
+        # Counters
+        self.forwarded = 0
+        self.received = 0
+        self.dropped = 0
+
+
+    def bind(self, idx):
+        """
+        Taking the shard of this worker process, closing the receiving ends
+        of the other shards.
+
+        Args:
+            idx: The shard index.
+        """
+
+        self.idx = idx
+
+        for peer, pair in enumerate(self.pairs):
+            if peer != idx:
+                pair[0].close()
+
+
+    def start(self, on_forward, loop=None):
+        """
+        Starting to receive the broadcasts of the other shards.
+
+        Args:
+            on_forward: Called with each forwarded datagram.
+            loop: The event loop, the current one if None.
+        """
+
+        self.on_forward = on_forward
+        self.event_loop = loop or asyncio.get_event_loop()
+        self.event_loop.add_reader(self.pairs[self.idx][0].fileno(),
+                                   self._receive)
+
+
+    def forward(self, data):
+        """
+        Sending a datagram to all the other shards. Datagrams are dropped
+        if a shard is not keeping up, as they would be by the network.
+
+        Args:
+            data: The datagram.
+        """
+
+        for peer, pair in enumerate(self.pairs):
+            if peer == self.idx:
+                continue
+
+            try:
+                pair[1].send(data)
+                self.forwarded += 1
+            except OSError:
+                self.dropped += 1
+
+
+    def _receive(self):
+        """
+        Reading all the pending forwarded datagrams.
+        """
+
+        sock = self.pairs[self.idx][0]
+
+        while True:
+            try:
+                data = sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+
+            self.received += 1
+            self.on_forward(data)
+
+
+    def stats(self):
+        """
+        Getting the link counters.
+
+        Returns:
+            A dict of the forwarded, received and dropped datagrams.
+        """
+
+        return {'forwarded': self.forwarded,
+                'received': self.received,
+                'dropped': self.dropped}
+
+
+    def close(self):
+        """
+        Stopping to receive.
+        """
+
+        if self.event_loop is not None:
+            self.event_loop.remove_reader(self.pairs[self.idx][0].fileno())
+            self.event_loop = None
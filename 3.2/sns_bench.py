@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 3
+# Task 3.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Microbenchmark of the datagram handling of Sensor Network Protocol,
+# reporting packets per second on one core, without and with sampled
+# tracing. SHAKE datagrams are queued, but not sent.
+# Usage: python3 sns_bench.py [peers]
+#
+
+import asyncio
+import logging
+import os
+import socket
+import struct
+import sys
+import time
+
+from sns_proto import SensorNetProtocol
+from sns_log import LogPipeline
+
+
+class BenchTransport(object):
+    """
+    Datagram transport stand-in, owning an unused socket.
+    """
+
+    def __init__(self):
+        """
+        Initializing.
+        """
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+
+    def get_extra_info(self, name):
+        """
+        Getting the socket.
+        """
+
+        return self.sock if name == 'socket' else None
+
+
+    def sendto(self, data, addr):
+        """
+        Dropping data.
+        """
+
+
+def bench(label, proto, data, addr, number):
+    """
+    Printing the packets per second of one packet type, best of five runs.
+    """
+
+    best = None
+    received = proto.datagram_received
+
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            received(data, addr)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+        # Not letting queued broadcasts pile up between runs
+        proto.fan_out.jobs.clear()
+
+    print('%-28s %10.0f packets/s' % (label, number / best))
+
+
+if __name__ == '__main__':
+    peers = int(sys.argv[1]) if len(sys.argv) == 2 else 100
+    number = 100000
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    logging.basicConfig(level=logging.WARNING)
+    proto = SensorNetProtocol()
+    proto.connection_made(BenchTransport())
+
+    for idx in range(peers):
+        name = ('sensor_%d' % idx).encode()
+        proto.datagram_received(struct.pack('BB%ds' % len(name), 1,
+                                            len(name), name),
+                                ('10.0.%d.%d' % (idx // 256, idx % 256),
+                                 40000))
+
+    addr = ('10.0.0.0', 40000)
+    print('%d registered clients' % len(proto.client_pool))
+
+    bench('KEEPALIVE', proto, struct.pack('B', 3), addr, number)
+    bench('REG of a registered client', proto,
+          struct.pack('BB8s', 1, 8, b'sensor_0'), addr, number)
+    bench('EVENT', proto, struct.pack('!BQ', 4, int(time.time())), addr,
+          number // 10)
+    bench('Unknown type', proto, struct.pack('B', 9), addr, number)
+
+    # Sampled tracing through the non-blocking pipeline
+    log = LogPipeline(os.devnull, level=logging.DEBUG)
+    log.start()
+    for every in (1, 100):
+        proto.trace_every = proto.trace_countdown = every
+        bench('KEEPALIVE, tracing 1/%d' % every, proto,
+              struct.pack('B', 3), addr, number)
+    log.stop()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# Communication Systems Lab
+# Assignment 3
+# Task 3.2
+# Author: Tong, Michael
+# ##############################
+# Description:
+# Non-blocking logging of Sensor Network Server. Records are put on a queue
+# by the event loop and written to the log file by a background thread.
+#
+
+import logging
+import logging.handlers
+import queue
+
+
+class LogPipeline(object):
+    """
+    Logging pipeline: a QueueHandler on the root logger, and a
+    QueueListener thread owning the file handler, so that the event loop
+    never waits on disk IO.
+    """
+
+    def __init__(self, filename, level=logging.INFO, max_queued=65536):
+        """
+        Initialization.
+
+        Args:
+            filename: The log file name.
+            level: The level of the root logger.
+            max_queued: The maximum number of queued records, further
+                        records are dropped while the writer is behind.
+        """
+
+        self.filename = filename
+        self.level = level
+
+        self.queue = queue.Queue(max_queued)
+        self.queue_handler = _DroppingQueueHandler(self.queue)
+        self.listener = None
+
+
+    def start(self):
+        """
+        Starting the writer thread and routing the root logger to the queue.
+        Has to be called in the process writing the log, the thread doesn't
+        survive a fork.
+        """
+
+        file_handler = logging.FileHandler(self.filename)
+        file_handler.setFormatter(
+            logging.Formatter('%(asctime)s %(process)d %(message)s'))
+
+        self.listener = _BlockingStopQueueListener(
+            self.queue, file_handler, respect_handler_level=True)
+        self.listener.start()
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.level)
+
+
+    def stop(self):
+        """
+        Flushing the queued records and stopping the writer thread.
+        """
+
+        root = logging.getLogger()
+        root.removeHandler(self.queue_handler)
+
+        if self.listener is None:
+            return
+
+        self.listener.stop()
+
+        # Written directly, the queue may be the one being full
+        if self.queue_handler.dropped:
+            record = root.makeRecord(root.name, logging.WARNING, __file__, 0,
+                                     '%d log records dropped.',
+                                     (self.queue_handler.dropped,), None)
+            for handler in self.listener.handlers:
+                handler.handle(record)
+
+        for handler in self.listener.handlers:
+            handler.close()
+        self.listener = None
+
+
+class _BlockingStopQueueListener(logging.handlers.QueueListener):
+    """
+    Queue listener waiting for room for its stop sentinel, the queue may be
+    full when it is stopped.
+    """
+
+    def enqueue_sentinel(self):
+        """
+        Queueing the sentinel behind the pending records, waiting while the
+        writer thread makes room.
+        """
+
+        self.queue.put(self._sentinel)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler counting the records dropped on a full queue, instead of
+    blocking or reporting an error for each.
+    """
+
+    def __init__(self, log_queue):
+        """
+        Initialization.
+
+        Args:
+            log_queue: The bounded record queue.
+        """
+
+        super(_DroppingQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+
+
+    def enqueue(self, record):
+        """
+        Queueing a record without waiting.
+
+        Args:
+            record: The prepared log record.
+        """
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
@@ -10,20 +10,31 @@
 
 # Asynchronous IO support
 import asyncio
-import time
 import struct
 
 import logging
 
+# Registered clients
+from client_pool import ClientPool
+# Broadcasting
+from fan_out import FanOut
+
 
 class SensorNetProtocol(asyncio.DatagramProtocol):
     """
     Sensor Network Protocol. Based on asyncio datagram protocol.
     """
 
-    def __init__(self):
+    def __init__(self, trace_every=0, shard_link=None):
         """
         Initialization.
+
+        Args:
+            trace_every: Tracing one in every trace_every datagrams, at
+                         DEBUG level, tracing none if 0.
+            shard_link: The links to the other shards if sharded, the
+                        client pool then only holds the clients of this
+                        shard.
         """
 
         # Data type definition
@@ -43,34 +54,31 @@ class SensorNetProtocol(asyncio.DatagramProtocol):
         self.TYPE[self.TYPE_EVE] = 'EVENT'
         self.TYPE[self.TYPE_SHK] = 'SHAKE'
 
-        # Operation type
-        self.OP_IGN     = 0
-        self.OP_REFRESH = 1
-        self.OP_REG     = 2
-        self.OP_UNREG   = 3
-        self.OP_BRDCST  = 4
-
-        # Operation description
-        self.OP = dict()
-        self.OP[self.OP_IGN] = 'IGNORE'
-        self.OP[self.OP_REFRESH] = 'REFRESH'
-        self.OP[self.OP_REG] = 'REG'
-        self.OP[self.OP_UNREG] = 'UNREG'
-        self.OP[self.OP_BRDCST] = 'BROADCASTING'
+        # Precompiled codec: REG head (type, name length), EVENT (type,
+        # timestamp), and SHAKE head, followed by name length and name
+        self.REG_HEAD = struct.Struct('>BB')
+        self.EVENT = struct.Struct('>BQ')
+        self.SHAKE_HEAD = '>BQ'
 
-        # Client pool
-        self.client_pool = dict()
+        # Dispatch table, indexed by type byte
+        self.handlers = [None] * 256
+        self.handlers[self.TYPE_REG] = self._on_reg
+        self.handlers[self.TYPE_UNREG] = self._on_unreg
+        self.handlers[self.TYPE_KEP] = self._on_keepalive
+        self.handlers[self.TYPE_EVE] = self._on_event
 
-        self.ts_key = 'ts'
-        self.nm_key = 'nm'
+        # Client pool, silent clients expire after 20 seconds
+        self.client_pool = ClientPool(timeout=20)
 
         # Client transport
         self.client_transport = None
+        self.fan_out = None
+        self.shard_link = shard_link
 
-        # Initializing logging
-        logging.basicConfig(filename='/var/mysns/%d.log' % int(time.time()),
-                            format='%(asctime)s %(message)s',
-                            level=logging.DEBUG)
+        # Sampled per-datagram tracing, the log is configured by the server
+        self.logger = logging.getLogger('sns')
+        self.trace_every = trace_every
+        self.trace_countdown = trace_every
 
 
     def connection_made(self, transport):
@@ -83,6 +91,26 @@ class SensorNetProtocol(asyncio.DatagramProtocol):
         """
 
         self.client_transport = transport
+        self.fan_out = FanOut(transport)
+
+        if self.shard_link is not None:
+            self.shard_link.start(self._on_forward)
+
+
+    def connection_lost(self, exc):
+        """
+        Overriding the same-named function DatagramProtocol.connection_lost
+        from parent class, stopping the background work.
+
+        Args:
+            exc: The exception, or None if closed regularly.
+        """
+
+        self.client_pool.close()
+        if self.fan_out is not None:
+            self.fan_out.close()
+        if self.shard_link is not None:
+            self.shard_link.close()
 
 
     def datagram_received(self, data, addr):
@@ -96,113 +124,104 @@ class SensorNetProtocol(asyncio.DatagramProtocol):
             addr: The address of the peer sending the data.
         """
 
-        logging.debug('==== Datagram Received, addr: %s, port: %d'
-                      % (addr[0], addr[1]))
-
-        logging.debug('Data Parsing.')
-        parsed_data = self._data_parse(data)
+        if not data:
+            return
 
-        logging.debug('Operation Select.')
-        operation = self._operation_select(parsed_data, addr)
-        logging.debug('Operation %s is selected.' % (self.OP[operation]))
+        handler = self.handlers[data[0]]
 
-        logging.debug('Performing Operation.')
-        self._perform_operation(operation, parsed_data, addr)
+        if handler is not None:
+            handler(data, addr)
 
-        logging.debug('Client pool: %s' % (str(self.client_pool)))
-        logging.debug('==== Procedure DONE!')
+        # Nothing is logged or formatted for datagrams not sampled
+        if self.trace_every:
+            self.trace_countdown -= 1
+            if not self.trace_countdown:
+                self.trace_countdown = self.trace_every
+                self._trace(data, addr, handler is not None)
 
 
-    def _data_parse(self, data):
+    def _trace(self, data, addr, known):
         """
-        Parsing the incoming data.
+        Logging a sampled datagram, with the size of the client pool instead
+        of its content.
 
         Args:
             data: The incoming data.
+            addr: The address of the peer sending the data.
+            known: Whether the type of the data is known.
+        """
+
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
 
-        Returns:
-            Parsed data.
+        self.logger.debug('Datagram from %s:%d, type: %s, %d bytes, '
+                          '%d clients', addr[0], addr[1],
+                          self.TYPE[data[0] if known else self.TYPE_UNKN],
+                          len(data), len(self.client_pool))
+
+
+    def _on_reg(self, data, addr):
         """
+        Handling REG, registering a new client or refreshing a registered
+        one.
+
+        Args:
+            data: The incoming data.
+            addr: The client address.
+        """
+
+        if addr in self.client_pool:
+            self._refresh(addr)
+            return
 
-        data_type = int(data[0])
-        res = [data_type]
+        if len(data) < self.REG_HEAD.size:
+            return
 
-        if data_type == self.TYPE_REG:
-            res.append(int(data[1]))
-            res.append(data[2:(2 + int(data[1]))].decode())
-        elif data_type == self.TYPE_UNREG or data_type == self.TYPE_KEP:
-            pass
-        elif data_type == self.TYPE_EVE:
-            res.append(data[1:9])
-        else:
-            res[0] = self.TYPE_UNKN
+        name_len = data[1]
+        name = memoryview(data)[2:2 + name_len]
+        if len(name) < name_len:
+            return
 
-        return res
+        self._reg(addr, bytes(name))
 
 
-    def _operation_select(self, data, addr):
+    def _on_unreg(self, data, addr):
         """
-        Selecting operation according to parsed data.
+        Handling UNREG.
 
         Args:
-            data: Parsed data.
-            addr: Client address.
-
-        Returns:
-            Operation types:
-                OP_IGN     : Ignore
-                OP_REFRESH : Refreshing
-                OP_REG     : Registering
-                OP_UNREG   : Unregistering
-                OP_BRDCST  : Broadcasting
+            data: The incoming data.
+            addr: The client address.
         """
 
+        self._unreg(addr)
 
-        if addr in self.client_pool:
-            if data[0] == self.TYPE_REG or data[0] == self.TYPE_KEP:
-                return self.OP_REFRESH
-            elif data[0] == self.TYPE_EVE:
-                return self.OP_BRDCST
-            elif data[0] == self.TYPE_UNREG:
-                return self.OP_UNREG
-            else:
-                return self.OP_IGN
-        else:
-            if data[0] == self.TYPE_REG:
-                return self.OP_REG
-            else:
-                return self.OP_IGN
-
-
-    def _perform_operation(self, operation, data, addr):
+
+    def _on_keepalive(self, data, addr):
         """
-        Performing operation.
+        Handling KEEPALIVE.
 
         Args:
-            operation: Operation type.
-            data: Parsed data.
-            addr: Relative client address.
+            data: The incoming data.
+            addr: The client address.
         """
 
+        self._refresh(addr)
 
-        if addr in self.client_pool:
-            if operation == self.OP_IGN:
-                pass
-            elif operation == self.OP_REFRESH:
-                self._refresh(addr)
-            elif operation == self.OP_REG:
-                self._reg(addr, data[2])
-            elif operation == self.OP_UNREG:
-                self._unreg(addr)
-            elif operation == self.OP_BRDCST:
-                self._broadcast(addr, data[1])
-            else:
-                pass
-        else:
-            if operation == self.OP_REG:
-                self._reg(addr, data[2])
-            else:
-                pass
+
+    def _on_event(self, data, addr):
+        """
+        Handling EVENT, broadcasting a SHAKE to the other clients.
+
+        Args:
+            data: The incoming data.
+            addr: The client address.
+        """
+
+        if len(data) < self.EVENT.size:
+            return
+
+        self._broadcast(addr, self.EVENT.unpack_from(data)[1])
 
 
     def _refresh(self, addr):
@@ -213,26 +232,22 @@ class SensorNetProtocol(asyncio.DatagramProtocol):
             addr: The address to be refreshed.
         """
 
-        if addr in self.client_pool:
-            self.client_pool[addr][self.ts_key] = time.time()
-
+        self.client_pool.refresh(addr)
 
 
     def _reg(self, addr, name):
         """
-        Registering a new client.
+        Registering a new client, prebuilding the packer of its SHAKE
+        payload.
 
         Args:
             addr: The address to be registered.
-            name: The name of the client.
+            name: The name of the client in bytes.
         """
 
-        if addr in self.client_pool:
-            self.client_pool[addr][self.ts_key] = time.time()
-        else:
-            self.client_pool[addr] = dict()
-            self.client_pool[addr][self.nm_key] = name
-            self.client_pool[addr][self.ts_key] = time.time()
+        shake = struct.Struct('%sB%ds' % (self.SHAKE_HEAD, len(name)))
+        self.client_pool.register(addr, name.decode(errors='replace'),
+                                  (shake, len(name), name))
 
 
     def _unreg(self, addr):
@@ -243,8 +258,7 @@ class SensorNetProtocol(asyncio.DatagramProtocol):
             addr: The address to be unregistered.
         """
 
-        if addr in self.client_pool:
-            del self.client_pool[addr]
+        self.client_pool.remove(addr)
 
 
     def _broadcast(self, addr, ts):
@@ -259,15 +273,27 @@ class SensorNetProtocol(asyncio.DatagramProtocol):
         if addr not in self.client_pool:
             return
 
-        # Assembling data
-        data = struct.pack('>B', self.TYPE_SHK)
-        data = data + ts
-        data = data + struct.pack('>B', len(self.client_pool[addr][self.nm_key]))
-        data = data + self.client_pool[addr][self.nm_key].encode()
+        # Assembling data in one go with the packer of the client
+        shake, name_len, name = self.client_pool.payload(addr)
+        data = shake.pack(self.TYPE_SHK, ts, name_len, name)
+
+        # Expired clients have already been removed in background, the
+        # datagrams are sent in batches across loop iterations
+        self.fan_out.broadcast(data, [key for key in self.client_pool
+                                      if key != addr])
 
-        ava_filter = lambda x : (time.time() - x[1][self.ts_key] < 20)
-        self.client_pool = dict(filter(ava_filter, self.client_pool.items()))
+        # The clients of the other shards are reached by their workers
+        if self.shard_link is not None:
+            self.shard_link.forward(data)
+
+
+    def _on_forward(self, data):
+        """
+        Broadcasting a SHAKE forwarded by another shard to all the clients,
+        the originating client is registered in the other shard.
+
+        Args:
+            data: The SHAKE datagram.
+        """
 
-        for key, value in self.client_pool.items():
-            if key != addr:
-                self.client_transport.sendto(data, key)
+        self.fan_out.broadcast(data, list(self.client_pool))
@@ -9,28 +9,54 @@
 #
 
 # Asynchronous IO support
+import argparse
 import asyncio
+import logging
+import os
 import sys
+import time
+from signal import SIGTERM
 
 # Daemonizing server
 from daemon_process import DaemonProcess
 
 # Sensor Network Protocol
 from sns_proto import SensorNetProtocol
+# Non-blocking logging
+from sns_log import LogPipeline
+# Forwarding between shards
+from shard_link import ShardLink
 
 
 class SensorNetServer(DaemonProcess):
     """
-    Sensor Network Server.
+    Sensor Network Server. With several workers, each worker process binds
+    the port with SO_REUSEPORT, and the kernel hashes each client address to
+    one of them. A worker thus only registers the clients of its shard, and
+    forwards the SHAKE datagrams of their events to the other workers.
+
+    A client whose worker is restarted may be hashed to another worker,
+    where it is unknown until it registers again.
     """
 
-    def __init__(self, pid_file, port=8123):
+    def __init__(self, pid_file, port=8123, workers=1, log_file=None,
+                 log_level=logging.INFO, trace_every=0, stats_interval=60):
         """
         Initialization.
 
         Args:
             pid_file: The file name for storing daemon process PID.
             port: The server's port, 8123 by default.
+            workers: The number of worker processes, each serving a shard
+                     of the clients.
+            log_file: The log file, named after the start time in
+                      /var/mysns if None.
+            log_level: The logging level, DEBUG for datagram traces.
+            trace_every: Tracing one in every trace_every datagrams, tracing
+                         none if 0.
+            stats_interval: Seconds between two summaries of the counters
+                            in the log, which is also written at shutdown.
+                            Only written at shutdown if None.
         """
 
         # Initializing parent class
@@ -42,44 +68,194 @@ class SensorNetServer(DaemonProcess):
         # Server setting
         self.host = '0.0.0.0' # Please firstly check ifconfig
         self.port = port
+        self.workers = workers
+
+        # Created before forking, so that all workers inherit the sockets
+        self.shard_link = ShardLink(workers) if workers > 1 else None
 
-        self.server = self.event_loop.create_datagram_endpoint(
-            SensorNetProtocol, local_addr=(self.host, self.port))
+        # Logging setting
+        self.log_file = log_file
+        self.log_level = log_level
+        self.trace_every = trace_every
+        self.stats_interval = stats_interval
+        self.stats_handle = None
 
 
     def run(self):
         """
         Overriding the run function in parent class.
-        The event loop begins from here.
+        The event loop begins from here, or from the workers.
         """
 
-        # Generating asynchronous server object
-        self.event_loop.run_until_complete(self.server)
+        # All workers append to the same log file
+        if self.log_file is None:
+            self.log_file = '/var/mysns/%d.log' % int(time.time())
+
+        if self.workers > 1:
+            self.run_workers(self.workers)
+        else:
+            self._serve()
+
+
+    def run_worker(self, idx):
+        """
+        Overriding the run_worker function in parent class.
+        Each worker runs its own event loop and serves its own shard.
+        """
 
-        # Main event loop begins to work
-        self.event_loop.run_forever()
+        self.event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.event_loop)
+
+        self.shard_link.bind(idx)
+
+        self._serve(idx)
+
+
+    def _serve(self, idx=0):
+        """
+        Serving on the event loop of this process.
+
+        Args:
+            idx: The worker index.
+        """
+
+        # Starting the log writer thread, after daemonizing and forking
+        log = LogPipeline(self.log_file, level=self.log_level)
+        log.start()
+
+        # Stopping the loop on SIGTERM, so that queued records are written
+        self.event_loop.add_signal_handler(SIGTERM, self.event_loop.stop)
+
+        try:
+            # Generating asynchronous server object, workers share the port
+            server_coro = self.event_loop.create_datagram_endpoint(
+                lambda: SensorNetProtocol(trace_every=self.trace_every,
+                                          shard_link=self.shard_link),
+                local_addr=(self.host, self.port),
+                reuse_port=self.workers > 1)
+            transport, protocol = self.event_loop.run_until_complete(
+                server_coro)
+            logging.info('Worker %d listening on %s:%d.', idx, self.host,
+                         self.port)
+
+            self._schedule_stats(protocol)
+
+            # Main event loop begins to work
+            self.event_loop.run_forever()
+
+            if self.stats_handle is not None:
+                self.stats_handle.cancel()
+            self._log_stats(protocol)
+
+            transport.close()
+            self.event_loop.run_until_complete(asyncio.sleep(0))
+        finally:
+            log.stop()
+
+
+    def _schedule_stats(self, protocol):
+        """
+        Scheduling the next summary of the counters, if enabled.
+
+        Args:
+            protocol: The protocol of the server endpoint.
+        """
+
+        if self.stats_interval:
+            self.stats_handle = self.event_loop.call_later(
+                self.stats_interval, self._report_stats, protocol)
+
+
+    def _report_stats(self, protocol):
+        """
+        Writing the periodic summary of the counters.
+
+        Args:
+            protocol: The protocol of the server endpoint.
+        """
+
+        self._log_stats(protocol)
+        self._schedule_stats(protocol)
+
+
+    def _log_stats(self, protocol):
+        """
+        Writing the counters of the fan-out engine, and of the links to the
+        other shards, into the log.
+
+        Args:
+            protocol: The protocol of the server endpoint.
+        """
+
+        logging.info('%d clients registered.', len(protocol.client_pool))
+
+        if protocol.fan_out is not None:
+            stats = protocol.fan_out.stats()
+            logging.info('Fan-out: %d broadcasts, %d datagrams sent, %d '
+                         'deferred, %d failed, %d queued, latency mean '
+                         '%.3f ms, max %.3f ms.', stats['broadcasts'],
+                         stats['datagrams'], stats['deferred'],
+                         stats['errors'], stats['queued'],
+                         stats['latency_mean'] * 1000,
+                         stats['latency_max'] * 1000)
+
+        if self.shard_link is not None:
+            stats = self.shard_link.stats()
+            logging.info('Shard link: %d datagrams forwarded, %d received, '
+                         '%d dropped.', stats['forwarded'],
+                         stats['received'], stats['dropped'])
+
+
+def parse_args():
+    """
+    Parsing the command line arguments. Paths are made absolute, as the
+    daemon changes its working directory.
+
+    Returns:
+        The parsed arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Sensor Network Server.')
+    parser.add_argument('command', choices=('start', 'stop', 'restart'))
+    parser.add_argument('--port', type=int, default=8123,
+                        help='port to bind')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--log-file', type=os.path.abspath,
+                        help='log file, named after the start time in '
+                        '/var/mysns by default')
+    parser.add_argument('--log-level', default='INFO',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help='logging level, DEBUG for datagram traces')
+    parser.add_argument('--trace-every', type=int, default=0,
+                        help='tracing one in every N datagrams, none if 0')
+    parser.add_argument('--stats-interval', type=float, default=60,
+                        help='seconds between two summaries of the '
+                        'counters, only at shutdown if 0')
+
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
     # Checking python version
-    if sys.version_info < (3, 5, 0):
-        print('Must use Python 3.5.0 or later.')
+    if sys.version_info < (3, 7, 0):
+        print('Must use Python 3.7.0 or later.')
         exit(1)
 
+    # Parsing arguments
+    args = parse_args()
+
     # Entrance, creating server object
-    daemon = SensorNetServer('/var/mysns/csl_sns_daemon.pid')
+    daemon = SensorNetServer('/var/mysns/csl_sns_daemon.pid',
+                             port=args.port, workers=args.workers,
+                             log_file=args.log_file,
+                             log_level=getattr(logging, args.log_level),
+                             trace_every=args.trace_every,
+                             stats_interval=args.stats_interval or None)
 
-    # Parsing arguments
-    if len(sys.argv) == 2:
-        if 'start' == sys.argv[1]:
-            daemon.start()
-        elif 'stop' == sys.argv[1]:
-            daemon.stop()
-        elif 'restart' == sys.argv[1]:
-            daemon.restart()
-        else:
-            print('Usage: %s [start|stop|restart]' % sys.argv[0])
-            sys.exit(1)
-    else:
-        print('Usage: %s [start|stop|restart]' % sys.argv[0])
-        sys.exit(1)
+    if 'start' == args.command:
+        daemon.start()
+    elif 'stop' == args.command:
+        daemon.stop()
+    elif 'restart' == args.command:
+        daemon.restart()